@@ -7,33 +7,65 @@ from antelope_core.entities import MetaQuantityUnit
 from antelope.models.auth import AuthorizationGrant, JwtGrant
 from antelope_core.contexts import NullContext
 
-from .models.response import ServerMeta, PostTerm
-
-from .runtime import cat, search_entities, do_lcia, init_origin, MASTER_ISSUER
-from .qdb import qdb_router
-
-from .libs.xdb_query import InterfaceNotAuthorized
-
-from antelope import EntityNotFound, MultipleReferences, NoReference, check_direction, EXCHANGE_TYPES, IndexRequired, UnknownOrigin
+from .models.response import (ServerMeta, PostTerm, BatchLciaRequest, BatchLciaRow, LciaContribution,
+                              LciaContributionResult, MonteCarloRequest, MonteCarloResult, ScenarioRequest,
+                              ScenarioResult, ScenarioExchangeScore, ScenarioBatchResult, JobStatus)
+
+from .runtime import (cat, search_entities, do_lcia, lcia_categories, table_lcia, init_origin, category_executor,
+                      MASTER_ISSUER, CAT_ROOT)
+from .qdb import qdb_router, post_lcia_exchanges
+
+from .libs.xdb_query import InterfaceNotAuthorized, observed_key
+from .libs.models import UsageBucket
+from .libs.metrics import RequestMetrics, render_meter, render_cache_stats
+from .libs.timing import TimedRoute, start_timer, stop_timer, timed
+from .libs.profiling import start_profile, stop_profile
+from .libs.contribution import contributions, top_contributions, BY_PROCESS, BY_FLOW
+from .libs.lcia_tables import characterization_matrix
+from .libs.monte_carlo import MonteCarloLcia, distribution
+from .libs.scenarios import ScenarioBatch, ScenarioError
+from .libs.jobs import JobQueue, QueueFull, DONE, FAILED
+
+from antelope import EntityNotFound, MultipleReferences, NoReference, check_direction, EXCHANGE_TYPES, IndexRequired, UnknownOrigin, comp_dir
 from antelope.xdb_tokens import IssuerKey
 
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 
 from jose import JWTError, ExpiredSignatureError, jwt
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from typing import List, Optional
 import logging
+import json
 import os
+from time import perf_counter
 from datetime import datetime
 
 
 LOGLEVEL = os.environ.get('LOGLEVEL', default='INFO').upper()
 logging.basicConfig(level=LOGLEVEL)
 
+SERVER_TIMING = bool(os.environ.get('XDB_SERVER_TIMING'))  # opt-in phase timing
+timing_log = logging.getLogger('xdb.timing')
+
+PROFILE_HEADER = 'X-Xdb-Profile'  # carries a 'profile' command token
+PROFILE_DIR = os.path.join(CAT_ROOT, 'profiles')
+
+MAX_BATCH_LCIA = int(os.environ.get('XDB_MAX_BATCH_LCIA', 20000))  # nodes x quantities per batch_lcia request
+MAX_SYS_LCI_DEMANDS = int(os.environ.get('XDB_MAX_SYS_LCI_DEMANDS', 1000))  # demands per sys_lci/batch request
+MAX_MC_SAMPLES = int(os.environ.get('XDB_MAX_MC_SAMPLES', 2000))  # Monte Carlo samples per request
+MAX_MC_SECONDS = float(os.environ.get('XDB_MAX_MC_SECONDS', 10.0))  # Monte Carlo time budget per request
+MAX_SCENARIOS = int(os.environ.get('XDB_MAX_SCENARIOS', 10000))  # scenarios per request
+
+JOB_WORKERS = int(os.environ.get('XDB_JOB_WORKERS', 2))
+JOB_QUEUE = int(os.environ.get('XDB_JOB_QUEUE', 100))  # jobs waiting beyond this are refused
+JOB_TTL = float(os.environ.get('XDB_JOB_TTL', 3600))  # seconds finished job results are kept
+
 
 bbhost = os.environ.get('BLACKBOOK_HOST', None)
 if bbhost:
@@ -46,6 +78,7 @@ app = FastAPI(
     version="0.1.1",  # blackbook integration
     description="API for the exchange database"
 )
+app.router.route_class = TimedRoute  # must precede route declarations
 
 app.include_router(qdb_router)
 
@@ -65,16 +98,95 @@ app.add_middleware(
 )
 
 
+metrics = RequestMetrics()
+jobs = JobQueue(os.path.join(CAT_ROOT, 'jobs'), workers=JOB_WORKERS, max_queued=JOB_QUEUE, ttl=JOB_TTL)
+
+
+def _route_template(request: Request):
+    """
+    The path template of the matched route, e.g. '/{origin}/{process}/lci', so that metrics don't fan out by URL
+    """
+    route = request.scope.get('route')
+    if route is not None:
+        return route.path
+    endpoint = request.scope.get('endpoint')
+    if endpoint is not None:
+        return endpoint.__name__
+    return 'unmatched'
+
+
+def _check_profile_request(request: Request):
+    """
+    A request may ask to be profiled by presenting a master-issuer command token 'profile:<mode>' in the
+    X-Xdb-Profile header.  mode 'summary' also writes a text summary alongside the pstats file.
+    :param request:
+    :return: whether the request carries a valid profile token
+    """
+    profile_token = request.headers.get(PROFILE_HEADER)
+    if profile_token is None:
+        return False
+    command, arg = get_token_command(profile_token)
+    if command != 'profile':
+        raise HTTPException(400, detail="command token is incorrect")
+    return arg
+
+
 async def catch_exceptions_middleware(request: Request, call_next):
+    start = perf_counter()
+    status = 500
+    timer = token = None
+    prof = ptoken = None
+    if SERVER_TIMING:
+        timer, token = start_timer()
     try:
-        return await call_next(request)
+        mode = _check_profile_request(request)
+        if mode is not False:
+            prof, ptoken = start_profile(PROFILE_DIR, request.url.path, summary=(mode == 'summary'))
+        response = await call_next(request)
+        status = response.status_code
+        if timer is not None:
+            response.headers['Server-Timing'] = timer.header()
+        if prof is not None and prof.filename is not None:
+            response.headers['X-Xdb-Profile-File'] = prof.filename
+        return response
+    except HTTPException as e:  # endpoint HTTPExceptions are handled downstream; this one is from the profile check
+        status = e.status_code
+        metrics.error(_route_template(request), type(e).__name__)
+        return JSONResponse(content={'detail': e.detail}, status_code=e.status_code)
     except InterfaceNotAuthorized as e:
+        status = 403
+        metrics.error(_route_template(request), type(e).__name__)
         return JSONResponse(content="no grant found: origin: %s, iface: %s" % e.args, status_code=403)
+    except Exception as e:
+        metrics.error(_route_template(request), type(e).__name__)
+        raise
+    finally:
+        if prof is not None:
+            stop_profile(ptoken)
+        route = _route_template(request)
+        metrics.observe(request.method, route, status, perf_counter() - start)
+        if timer is not None:
+            stop_timer(token)
+            timing_log.info(json.dumps({'method': request.method, 'route': route, 'status': status,
+                                        'phases': timer.serialize()}))
 
 
 app.middleware('http')(catch_exceptions_middleware)
 
 
+@app.exception_handler(StarletteHTTPException)
+async def count_http_exception(request: Request, exc: StarletteHTTPException):
+    metrics.error(_route_template(request), type(exc).__name__)
+    return await http_exception_handler(request, exc)
+
+
+@app.on_event('shutdown')
+def flush_meter():
+    cat.meter.close()
+    category_executor.shutdown()
+    jobs.close()
+
+
 oauth2_scheme = OAuth2PasswordBearer(auto_error=False, tokenUrl="token")  # the tokenUrl argument appears to do nothing
 
 """
@@ -140,6 +252,9 @@ def _get_all_grants(user: str):
 def get_token_grants(token: Optional[str]):
     if token is None:
         return []
+    grants = cat.grant_cache.get(token)
+    if grants is not None:
+        return grants
     try:
         payload = jwt.decode(token, 'a fish', options={'verify_signature': False})
     except ExpiredSignatureError:
@@ -158,14 +273,29 @@ def get_token_grants(token: Optional[str]):
     # however, we also need to test whether the issuer is trusted with the requested origin(s). otherwise one
     # compromised key would allow a user to issue a token for any origin
     if payload['iss'] == MASTER_ISSUER:
-        return _get_all_grants(user=payload['sub'])
-    jwt_grant = JwtGrant(**valid_payload)
-    return AuthorizationGrant.from_jwt(jwt_grant)
+        grants = _get_all_grants(user=payload['sub'])
+    else:
+        jwt_grant = JwtGrant(**valid_payload)
+        grants = AuthorizationGrant.from_jwt(jwt_grant)
+    # valid until the token or the issuer's key expires, whichever comes first
+    expiry = min(valid_payload.get('exp') or iss.expiry, iss.expiry)
+    cat.grant_cache.put(token, payload['iss'], expiry, grants)
+    return grants
+
+
+def get_auth_grants(token: Optional[str] = Depends(oauth2_scheme)):
+    """
+    Request-scoped authorization.  FastAPI evaluates a dependency once per request, so the token is verified once and
+    the resulting grants are shared by every helper the handler calls, no matter how many origins it fans out to.
+    :param token:
+    :return: a list of AuthorizationGrants
+    """
+    with timed('auth'):
+        return get_token_grants(token)
 
 
 @app.get("/", response_model=ServerMeta)
-def get_server_meta(token: Optional[str] = Depends(oauth2_scheme)):
-    grants = get_token_grants(token)
+def get_server_meta(grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     sm = ServerMeta.from_app(app)
     # for org in PUBLIC_ORIGINS:
     #     sm.origins.append(org)
@@ -181,7 +311,7 @@ def update_issuer(issuer: str, issuer_key: IssuerKey, token: Optional[str] = Dep
         raise HTTPException(400, detail="command token is incorrect")
     if issuer == MASTER_ISSUER:
         raise HTTPException(403, detail="Remote update of master issuer key is not allowed")
-    cat.pubkeys[issuer] = issuer_key
+    cat.set_issuer_key(issuer_key)
     cat.save_pubkeys()
     return True
 
@@ -210,6 +340,8 @@ def update_origin(origin: str, interface: Optional[str] = None, token: Optional[
         result = init_origin(origin, reset=reset)
     except UnknownOrigin:
         raise HTTPException(404, "unknown origin %s" % origin)
+    # master-issuer grants enumerate cat.interfaces, which has just changed
+    cat.grant_cache.invalidate_issuer(MASTER_ISSUER)
 
     if interface is None:
         return result
@@ -217,7 +349,166 @@ def update_origin(origin: str, interface: Optional[str] = None, token: Optional[
         return iface in cat.interfaces
 
 
-def _get_authorized_query(origin, token):
+@app.get("/update_lcia_tables/{origin}/{quantity}", response_model=int)
+@app.get("/update_lcia_tables/{origin}/{qty_org}/{quantity}", response_model=int)
+def update_lcia_tables(origin: str, quantity: str, qty_org: str = None, token: Optional[str] = Depends(oauth2_scheme)):
+    """
+    Build materialized LCIA tables for every background process in the origin-- one per category if the quantity
+    is an LCIA method.  Summary LCIA requests are then answered by table lookup.
+    :param origin:
+    :param quantity:
+    :param qty_org:
+    :param token: an 'lcia_tables' command token for the origin
+    :return: number of nodes scored
+    """
+    command, arg = get_token_command(token)
+    if command != 'lcia_tables' or arg != origin:
+        raise HTTPException(400, detail="command token is incorrect")
+    try:
+        qq, qs = cat.canonical_quantity(qty_org, quantity)
+    except EntityNotFound:
+        raise HTTPException(404, detail=f"Quantity {quantity} not found")
+    except UnknownOrigin:
+        raise HTTPException(404, detail=f"Unknown origin {qty_org}")
+    try:
+        return cat.build_lcia_tables(origin, list(qs))
+    except ValueError as e:
+        raise HTTPException(404, detail=str(e))
+
+
+@app.get("/usage/{user}", response_model=List[UsageBucket])
+def get_usage(user: str, start: float, end: Optional[float] = None, span: str = 'day',
+              token: Optional[str] = Depends(oauth2_scheme)):
+    """
+    Report a user's metered usage in hourly or daily buckets. Requires a 'usage:<user>' command token.
+    :param user:
+    :param start: Query param: epoch seconds
+    :param end: Query param: epoch seconds [now]
+    :param span: Query param: 'hour' or 'day' [day]
+    :param token:
+    :return:
+    """
+    command, arg = get_token_command(token)
+    if command != 'usage' or arg != user:
+        raise HTTPException(400, detail="command token is incorrect")
+    if end is None:
+        end = datetime.now().timestamp()
+    try:
+        return cat.meter.usage(user, start, end, span=span)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(token: Optional[str] = Depends(oauth2_scheme)):
+    """
+    Request counts, latency histograms and error counts per route template, metered queries per origin and
+    interface, and cache statistics, in the Prometheus text format.  Requires a 'metrics' command token.
+    :param token:
+    :return:
+    """
+    if token is None:
+        raise HTTPException(401, detail="a 'metrics' command token is required")
+    if get_token_command(token)[0] != 'metrics':
+        raise HTTPException(400, detail="command token is incorrect")
+    lines = metrics.render()
+    lines += render_meter(cat.meter)
+    caches = cat.cache_stats()
+    caches['jobs'] = jobs.stats()
+    lines += render_cache_stats(caches)
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
+
+
+def _job_user(grants):
+    if not grants:
+        raise HTTPException(401, detail="Jobs require an authenticated user")
+    return grants[0].user
+
+
+def _submit_job(grants, kind, func, *args, **kwargs):
+    try:
+        job = jobs.submit(_job_user(grants), kind, func, *args, **kwargs)
+    except QueueFull:
+        raise HTTPException(503, detail="Job queue is full; try again later")
+    return JobStatus.from_job(job)
+
+
+@app.post("/jobs/sys_lci/{origin}", response_model=JobStatus)
+def submit_sys_lci_job(origin: str, demands: List[List[UnallocatedExchange]],
+                       grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    sys_lci of one or more demands as a job; the result is as for /{origin}/sys_lci/batch.  Metered on submission.
+    """
+    _job_user(grants)
+    if len(demands) > MAX_SYS_LCI_DEMANDS:
+        raise HTTPException(400, detail=f"Batch exceeds {MAX_SYS_LCI_DEMANDS} demands")
+    query = _get_authorized_query(origin, grants)
+    for _ in demands:
+        query.authorize('background', 'sys_lci')
+    return _submit_job(grants, 'sys_lci', sys_lci_batch, origin, demands, grants=grants)
+
+
+@app.post("/jobs/lcia/{origin}/{process}/{quantity}", response_model=JobStatus)
+def submit_lcia_job(origin: str, process: str, quantity: str, ref_flow: str = None, qty_org: str = None,
+                    grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    A node's LCIA (e.g. for a whole method) as a job; the result is as for get_remote_lcia.  Metered on submission.
+    """
+    _job_user(grants)
+    pq = _get_authorized_query(origin, grants)
+    p = pq.get(process)
+    _get_rx_by_ref_flow(p, ref_flow)
+    query, qq = _get_lcia_quantity(qty_org, quantity, grants)
+    pq.authorize('background', 'lci')
+    return _submit_job(grants, 'lcia', get_remote_lcia, origin, process, quantity, ref_flow=ref_flow,
+                       qty_org=qty_org, grants=grants)
+
+
+@app.post("/jobs/do_lcia/{quantity_id}", response_model=JobStatus)
+def submit_lcia_exchanges_job(quantity_id: str, exchanges: List[UnallocatedExchange], locale: str = None,
+                              quell_biogenic_co2: bool = False,
+                              grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    LCIA of posted exchanges as a job; the result is as for /qdb/{quantity_id}/do_lcia.  Unlike that route, this one
+    requires a quantity grant for the quantity's origin, which is metered on submission.
+    """
+    _job_user(grants)
+    query, qq = _get_lcia_quantity(None, quantity_id, grants)
+    for _ in lcia_categories(query, qq):
+        query.authorize('quantity', 'do_lcia')
+    return _submit_job(grants, 'do_lcia', post_lcia_exchanges, quantity_id, exchanges, locale=locale,
+                       quell_biogenic_co2=quell_biogenic_co2)
+
+
+def _get_own_job(job_id, grants):
+    job = jobs.get(job_id)
+    if job is None or job.user != _job_user(grants):
+        raise HTTPException(404, detail="No job %s" % job_id)
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    return JobStatus.from_job(_get_own_job(job_id, grants))
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    The job's result, in the same form the synchronous route would have returned it
+    """
+    job = _get_own_job(job_id, grants)
+    if job.status == FAILED:
+        raise HTTPException(500, detail="Job failed: %s" % job.error)
+    if job.status != DONE:
+        raise HTTPException(409, detail="Job is %s" % job.status)
+    try:
+        return JSONResponse(content=jobs.result(job_id))
+    except (OSError, ValueError):
+        raise HTTPException(404, detail="Result of job %s is no longer available" % job_id)
+
+
+def _get_authorized_query(origin, grants):
     """
     The main point of this is to ask the auth server / oauth grant / etc what the supplied credentials authorize
     with respect to the stated origin.
@@ -262,31 +553,32 @@ def _get_authorized_query(origin, token):
     origin or the authorized one? I would tend toward the true origin. this is the masq[uerade] question.
 
     :param origin:
+    :param grants: the request's AuthorizationGrants, as resolved by get_auth_grants
     :return: a catalog query, with an authorized_interfaces attribute that returns: a set of authorizations. spec tbd.
     """
-    auth_grants = get_token_grants(token)
     # grants = UNRESTRICTED_GRANTS + auth_grants
-    q = cat.query(origin, grants=auth_grants, cache=False)  # XdbCatalog will return an XdbQuery which auto-enforces grants !!
+    with timed('query'):
+        q = cat.authorized_query(origin, grants)  # XdbCatalog will return an XdbQuery which auto-enforces grants !!
     # q.authorized_interfaces = set([k.split(':')[1] for k in cat.interfaces if k.startswith(origin)])
     return q
 
 
 @app.get("/origins", response_model=List[str])
-def get_origins(token: Optional[str] = Depends(oauth2_scheme)):
-    auth_grants = get_token_grants(token)
-    # all_origins = PUBLIC_ORIGINS + list(set(k.origin for k in auth_grants))
-    all_origins = list(set(k.origin for k in auth_grants))
+def get_origins(grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    # all_origins = PUBLIC_ORIGINS + list(set(k.origin for k in grants))
+    all_origins = list(set(k.origin for k in grants))
     return [org for org in all_origins if cat.known_origin(org)]
 
 
-def _origin_meta(origin, token):
+def _origin_meta(origin, grants):
     """
     It may well be that OriginMeta needs to include config information (at minimum, context hints)- in which
     case the meta object should be constructed from resources, not from blackbox queries. we shall see
     :param origin:
+    :param grants:
     :return:
     """
-    is_lcia = _get_authorized_query(origin, token).is_lcia_engine()
+    is_lcia = _get_authorized_query(origin, grants).is_lcia_engine()
     return {
         "origin": origin,
         "is_lcia_engine": is_lcia,
@@ -295,39 +587,39 @@ def _origin_meta(origin, token):
 
 
 @app.get("/{origin}", response_model=List[OriginMeta])
-def get_origin(origin: str, token: Optional[str] = Depends(oauth2_scheme)):
+def get_origin(origin: str, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
     Why does this return a list? because it's startswith
     TODO: reconcile the AVAILABLE origins with the CONFIGURED origins and the AUTHORIZED origins
     :param origin:
-    :param token:
+    :param grants:
     :return:
     """
-    return [_origin_meta(org, token) for org in cat.origins if org.startswith(origin)]
+    return [_origin_meta(org, grants) for org in cat.origins if org.startswith(origin)]
 
 
 @app.get("/{origin}/synonyms", response_model=List[str])
 @app.get("/{origin}/synonyms/{term}", response_model=List[str])
-def get_synonyms(origin: str, term: str, token: Optional[str] = Depends(oauth2_scheme)):
-    return _get_authorized_query(origin, token).synonyms(term)
+def get_synonyms(origin: str, term: str, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    return _get_authorized_query(origin, grants).synonyms(term)
 
 
 @app.post("/{origin}/synonyms", response_model=List[str])
-def post_synonyms(origin: str, post_term: PostTerm, token: Optional[str] = Depends(oauth2_scheme)):
-    return _get_authorized_query(origin, token).synonyms(post_term.term)
+def post_synonyms(origin: str, post_term: PostTerm, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    return _get_authorized_query(origin, grants).synonyms(post_term.term)
 
 
 @app.get("/{origin}/count", response_model=List[OriginCount])
-def get_origin(origin: str, token: Optional[str] = Depends(oauth2_scheme)):
-    return list(_get_origin_counts(origin, token))
+def get_origin(origin: str, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    return list(_get_origin_counts(origin, grants))
 
 
-def _get_origin_counts(origin: str, token: Optional[str]):
+def _get_origin_counts(origin: str, grants: List[AuthorizationGrant]):
     for org in cat.origins:
         if not org.startswith(origin):
             continue
         try:
-            q = _get_authorized_query(org, token)
+            q = _get_authorized_query(org, grants)
             yield {
                 'origin': org,
                 'count': {
@@ -353,35 +645,38 @@ def search_processes(origin: str,
                      classifications: Optional[str] = None,
                      spatialscope: Optional[str] = None,
                      comment: Optional[str] = None,
-                     token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                     tokens: bool = False,
+                     grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     kwargs = {'name': name,
               'classifications': classifications,
               'spatialscope': spatialscope,
               'comment': comment}
-    return list(search_entities(query, 'processes', **kwargs))
+    return list(search_entities(query, 'processes', tokens=tokens, **kwargs))
 
 
 @app.get("/{origin}/flows", response_model=List[FlowEntity])
 def search_flows(origin: str,
                  name: Optional[str] = None,
                  casnumber: Optional[str] = None,
-                 token: Optional[str] = Depends(oauth2_scheme)):
+                 tokens: bool = False,
+                 grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     kwargs = {'name': name,
               'casnumber': casnumber}
-    query = _get_authorized_query(origin, token)
-    return list(search_entities(query, 'flows', **kwargs))
+    query = _get_authorized_query(origin, grants)
+    return list(search_entities(query, 'flows', tokens=tokens, **kwargs))
 
 
 @app.get("/{origin}/quantities", response_model=List[Entity])
 def search_quantities(origin: str,
                       name: Optional[str] = None,
                       referenceunit: Optional[str] = None,
-                      token: Optional[str] = Depends(oauth2_scheme)):
+                      tokens: bool = False,
+                      grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     kwargs = {'name': name,
               'referenceunit': referenceunit}
-    query = _get_authorized_query(origin, token)
-    return list(search_entities(query, 'quantities', **kwargs))
+    query = _get_authorized_query(origin, grants)
+    return list(search_entities(query, 'quantities', tokens=tokens, **kwargs))
 
 
 @app.get("/{origin}/lcia_methods", response_model=List[Entity])
@@ -392,13 +687,13 @@ def search_lcia_methods(origin: str,
                         method: Optional[str] = None,
                         category: Optional[str] = None,
                         indicator: Optional[str] = None,
-                        token: Optional[str] = Depends(oauth2_scheme)):
+                        grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     kwargs = {'name': name,
               'referenceunit': referenceunit,
               'method': method,
               'category': category,
               'indicator': indicator}
-    query = _get_authorized_query(origin, token)
+    query = _get_authorized_query(origin, grants)
     return list(search_entities(query, 'lcia_methods', **kwargs))
 
 
@@ -406,17 +701,17 @@ def search_lcia_methods(origin: str,
 def get_meta_quantities(origin,
                         name: Optional[str] = None,
                         method: Optional[str] = None,
-                        token: Optional[str] = Depends(oauth2_scheme)):
+                        grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     kwargs = {'name': name,
               'method': method}
-    query = _get_authorized_query(origin, token)
+    query = _get_authorized_query(origin, grants)
     return list(search_entities(query, 'quantities', unit=MetaQuantityUnit.unitstring, **kwargs))
 
 
 @app.get("/{origin}/contexts", response_model=List[Context])
 def get_contexts(origin: str, elementary: bool = None, sense=None, parent=None,
-                 token: Optional[str] = Depends(oauth2_scheme)):
-    q = _get_authorized_query(origin, token)
+                 grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    q = _get_authorized_query(origin, grants)
     if parent is not None:
         parent = q.get_context(parent)
     cxs = [Context.from_context(cx) for cx in q.contexts()]
@@ -431,8 +726,8 @@ def get_contexts(origin: str, elementary: bool = None, sense=None, parent=None,
 
 @app.get("/{origin}/contexts/{context}", response_model=Context)
 def get_context(origin: str, context: str,
-                token: Optional[str] = Depends(oauth2_scheme)):
-    q = _get_authorized_query(origin, token)
+                grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    q = _get_authorized_query(origin, grants)
     naive_cx = q.get_context(context)
     if naive_cx is NullContext:
         wise_cx = cat.lcia_engine[context]
@@ -444,20 +739,20 @@ def get_context(origin: str, context: str,
 
 @app.get("/{origin}/{flow}/targets", response_model=List[Entity])
 def get_targets(origin, flow, direction: str = None,
-                token: Optional[str] = Depends(oauth2_scheme)):
+                grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
     According to the antelope spec, this returns a list of processes
     :param origin:
     :param flow:
     :param direction:
-    :param token:
+    :param grants:
     :return:
     """
 
     if direction is not None:
         direction = check_direction(direction)
     return list(Entity.from_entity(x) for x in
-                _get_authorized_query(origin, token).targets(flow, direction=direction))
+                _get_authorized_query(origin, grants).targets(flow, direction=direction))
 
 
 '''
@@ -482,8 +777,8 @@ def _get_typed_entity(q, entity, etype=None):
 
 @app.get("/{origin}/{entity}", response_model=Entity)
 def get_entity(origin: str, entity: str,
-               token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+               grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     e = _get_typed_entity(query, entity)
     if e.entity_type == 'process':
         ent = Entity.from_entity(e)
@@ -503,15 +798,15 @@ def get_entity(origin: str, entity: str,
 
 @app.get("/{origin}/processes/{entity}", response_model=Entity)
 def get_named_process(origin: str, entity: str,
-                      token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                      grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     return _get_typed_entity(query, entity, 'process')
 
 
 @app.get("/{origin}/flows/{entity}", response_model=Entity)
 def get_named_flow(origin: str, entity: str,
-                   token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                   grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     return _get_typed_entity(query, entity, 'flow')
 
 
@@ -521,13 +816,13 @@ def get_named_flow(origin: str, entity: str,
 @app.get("/{origin}/lciamethods/{entity}", response_model=Entity)
 @app.get("/{origin}/lcia_methods/{entity}", response_model=Entity)
 def get_named_quantity(origin: str, entity: str,
-                       token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                       grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     return _get_typed_entity(query, entity, 'quantity')
 
 
 @app.get("/{origin}/{entity}/reference")  # SHOOP
-def get_unitary_reference(origin, entity, token: Optional[str] = Depends(oauth2_scheme)):
+def get_unitary_reference(origin, entity, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
     Response model varies with entity type (!)
     Quantity: reference is unit
@@ -535,10 +830,10 @@ def get_unitary_reference(origin, entity, token: Optional[str] = Depends(oauth2_
     Process: reference is ReferenceExchange or an exception
     :param origin:
     :param entity:
-    :param token:
+    :param grants:
     :return:
     """
-    query = _get_authorized_query(origin, token)
+    query = _get_authorized_query(origin, grants)
     ent = _get_typed_entity(query, entity)
     if ent.entity_type == 'quantity':
         return ent.unit
@@ -560,32 +855,32 @@ def get_unitary_reference(origin, entity, token: Optional[str] = Depends(oauth2_
 @app.get("/{origin}/quantities/{entity}/references")
 @app.get("/{origin}/flowproperties/{entity}/references")
 @app.get("/{origin}/{entity}/references")
-def get_references(origin, entity, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_references(origin, entity, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     ent = _get_typed_entity(query, entity)
     if ent.entity_type == 'process':
         return list(ReferenceValue.from_rx(rx) for rx in ent.references())
     else:
-        return [get_unitary_reference(origin, entity, token)]
+        return [get_unitary_reference(origin, entity, grants)]
 
 
 @app.get("/{origin}/{entity}/uuid", response_model=str)
-def get_uuid(origin, entity, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_uuid(origin, entity, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     ent = _get_typed_entity(query, entity)
     return ent.uuid
 
 
 @app.get("/{origin}/{entity}/properties", response_model=List[str])  # SHOOP
-def get_properties(origin, entity, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_properties(origin, entity, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     ent = _get_typed_entity(query, entity)
     return list(ent.properties())
 
 
 @app.get("/{origin}/{entity}/doc/{item}")  # SHOOP
-def get_item(origin, entity, item, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_item(origin, entity, item, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     ent = _get_typed_entity(query, entity)
     try:
         return ent[item]
@@ -597,17 +892,17 @@ def get_item(origin, entity, item, token: Optional[str] = Depends(oauth2_scheme)
 @app.get("/{origin}/flowproperties/{entity}/unit")  # SHOOP
 @app.get("/{origin}/quantities/{entity}/unit")  # SHOOP
 @app.get("/{origin}/{entity}/unit")  # SHOOP
-def get_unit(origin, entity, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_unit(origin, entity, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     return getattr(_get_typed_entity(query, entity), 'unit')
 
 
 @app.get("/{origin}/flows/{flow}/context", response_model=Context)
 @app.get("/{origin}/{flow}/context", response_model=Context)
-def get_flow_context(origin, flow, token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+def get_flow_context(origin, flow, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     f = _get_typed_entity(query, flow, 'flow')
-    return get_context(origin, f.context[-1])  # can't remember if flow is already context-equipped
+    return get_context(origin, f.context[-1], grants)  # can't remember if flow is already context-equipped
 
 
 def _get_rx_by_ref_flow(p, ref_flow):
@@ -629,11 +924,11 @@ def _get_rx_by_ref_flow(p, ref_flow):
 @app.get('/{origin}/{process}/{ref_flow}/lcia/{quantity}', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/lcia/{quantity}', response_model=List[AllocatedExchange])
 def get_lci(origin: str, process: str, quantity: str, ref_flow: str = None, quell_biogenic_co2: bool = False,
-            token: Optional[str] = Depends(oauth2_scheme)):
+            grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
             ''' # is this already written???
             '''
-    query = _get_authorized_query(origin, token)
-    qdb = _get_authorized_query('local.qdb', token)
+    query = _get_authorized_query(origin, grants)
+    qdb = _get_authorized_query('local.qdb', grants)
     q = qdb.get(quantity)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
@@ -648,7 +943,7 @@ def get_lci(origin: str, process: str, quantity: str, ref_flow: str = None, quel
 @app.get("/{origin}/{process}/{ref_flow}/lcia/{quantity}", response_model=List[DetailedLciaResult])
 @app.get("/{origin}/{process}/{ref_flow}/lcia/{qty_org}/{quantity}", response_model=List[DetailedLciaResult])
 def get_remote_lcia(origin: str, process: str, quantity: str, ref_flow: str = None, qty_org: str = None,
-                    token: Optional[str] = Depends(oauth2_scheme)):
+                    grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
 
     :param origin:
@@ -656,34 +951,252 @@ def get_remote_lcia(origin: str, process: str, quantity: str, ref_flow: str = No
     :param quantity:
     :param ref_flow: [None] if process has multiple references, one must be specified
     :param qty_org: [None] if
-    :param token:
+    :param grants:
     :return:
     """
-    pq = _get_authorized_query(origin, token)
+    pq = _get_authorized_query(origin, grants)
     p = pq.get(process)
     rx = _get_rx_by_ref_flow(p, ref_flow)
-    lci = list(p.lci(rx))
+    query, qq = _get_lcia_quantity(qty_org, quantity, grants)
+    qs = lcia_categories(query, qq)
 
-    ress = _run_process_lcia(qty_org, quantity, token, lci)
+    if 'exchange' not in pq.authorized_interfaces():
+        # summary results: answer from a materialized LCIA table if there is one
+        with timed('compute'):
+            ress = table_lcia(pq, p, rx.flow.external_ref, qs)
+        if ress is not None:
+            with timed('serialize'):
+                return [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
 
-    if 'exchange' in pq.authorized_interfaces():
-        return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
-    else:
-        return [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
+    with timed('compute'):
+        lci = list(p.lci(rx))
+        ress = do_lcia(query, qq, lci, key=(pq.origin, p.external_ref, rx.flow.external_ref), categories=qs)
 
+    with timed('serialize'):
+        if 'exchange' in pq.authorized_interfaces():
+            return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
+        else:
+            return [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
 
-def _run_process_lcia(qty_org, quantity, token, lci):
-    if qty_org is None:
+
+def _get_background_solver(pq, p, rf):
+    """
+    The origin's BackgroundSolver, checking that the node is in it
+    """
+    solver = cat.background_solver(pq.origin)
+    if solver is None:
+        raise HTTPException(404, detail="%s has no flat background" % pq.origin)
+    try:
+        solver.flat.index_of(p.external_ref, rf)
+    except KeyError:
+        raise HTTPException(404, detail="%s/%s is not a background node" % (p.external_ref, rf))
+    return solver
+
+
+def _authorize_matrix_lcia(pq, qty_org, quantity, grants):
+    """
+    Resolve the quantity's categories, and authorize and meter a matrix-based LCIA the same as the live computation:
+    the process's background lci
+    :return: a CharacterizationVector per category
+    """
+    query, qq = _get_lcia_quantity(qty_org, quantity, grants)
+    qs = lcia_categories(query, qq)
+    pq.authorize('background', 'lci')
+    return [cat.characterization_vector(q) for q in qs]
+
+
+@app.get("/{origin}/{process}/contrib/{quantity}", response_model=List[LciaContributionResult])
+@app.get("/{origin}/{process}/contrib/{qty_org}/{quantity}", response_model=List[LciaContributionResult])
+@app.get("/{origin}/{process}/{ref_flow}/contrib/{quantity}", response_model=List[LciaContributionResult])
+@app.get("/{origin}/{process}/{ref_flow}/contrib/{qty_org}/{quantity}", response_model=List[LciaContributionResult])
+def get_lcia_contributions(origin: str, process: str, quantity: str, ref_flow: str = None, qty_org: str = None,
+                           by: str = BY_PROCESS, count: int = 20,
+                           grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    A node's LCIA result split by contributing background process, or by exterior flow, computed in one pass over the
+    node's scaling vector and the characterized B matrix.  Requires the same exchange grant as detailed LCIA results.
+    :param origin:
+    :param process:
+    :param quantity:
+    :param ref_flow:
+    :param qty_org:
+    :param by: 'process' or 'flow'
+    :param count: [20] number of contributions to list; the rest are reported as remainder
+    :param grants:
+    :return: one result per category
+    """
+    if by not in (BY_PROCESS, BY_FLOW):
+        raise HTTPException(400, detail="by must be '%s' or '%s'" % (BY_PROCESS, BY_FLOW))
+    if count < 0:
+        raise HTTPException(400, detail="count must be nonnegative")
+    pq = _get_authorized_query(origin, grants)
+    if 'exchange' not in pq.authorized_interfaces():
+        raise HTTPException(403, detail="Contribution analysis requires an exchange grant")
+    p = pq.get(process)
+    rx = _get_rx_by_ref_flow(p, ref_flow)
+    rf = rx.flow.external_ref
+    solver = _get_background_solver(pq, p, rf)
+    vectors = _authorize_matrix_lcia(pq, qty_org, quantity, grants)
+
+    with timed('compute'):
+        contrib, term = contributions(solver, vectors, p.external_ref, rf, by=by)
+
+    with timed('serialize'):
+        results = []
+        for k, vec in enumerate(vectors):
+            keep, remainder = top_contributions(contrib[:, k], count)
+            items = []
+            for i in keep:
+                kind, t = term(i)
+                if kind == BY_FLOW:
+                    cx = solver.flat.context_map.get(t.term_ref)
+                    items.append(LciaContribution(entity_id=t.flow_ref, name=solver.impl[t.flow_ref].name,
+                                                  direction=comp_dir(t.direction),
+                                                  context=None if cx is None else list(cx),
+                                                  result=float(contrib[i, k])))
+                else:
+                    items.append(LciaContribution(entity_id=t.term_ref, name=solver.impl[t.term_ref].name,
+                                                  ref_flow=t.flow_ref, result=float(contrib[i, k])))
+            results.append(LciaContributionResult(origin=pq.origin, process=p.external_ref, ref_flow=rf,
+                                                  quantity=vec.quantity.external_ref, by=by,
+                                                  total=float(contrib[:, k].sum()), remainder=remainder,
+                                                  contributions=items))
+        return results
+
+
+@app.post("/{origin}/{process}/uncertainty/{quantity}", response_model=List[MonteCarloResult])
+@app.post("/{origin}/{process}/uncertainty/{qty_org}/{quantity}", response_model=List[MonteCarloResult])
+@app.post("/{origin}/{process}/{ref_flow}/uncertainty/{quantity}", response_model=List[MonteCarloResult])
+@app.post("/{origin}/{process}/{ref_flow}/uncertainty/{qty_org}/{quantity}", response_model=List[MonteCarloResult])
+def post_monte_carlo_lcia(origin: str, process: str, quantity: str, spec: MonteCarloRequest, ref_flow: str = None,
+                          qty_org: str = None, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    Monte Carlo LCIA of a background node under client-specified uncertainty.  Sample count and running time are
+    capped by the server.  Individual sample values are only returned with an exchange grant.
+    :param origin:
+    :param process:
+    :param quantity:
+    :param spec: MonteCarloRequest
+    :param ref_flow:
+    :param qty_org:
+    :param grants:
+    :return: one result per category
+    """
+    if spec.samples < 1 or spec.samples > MAX_MC_SAMPLES:
+        raise HTTPException(400, detail=f"samples must be between 1 and {MAX_MC_SAMPLES}")
+    if spec.gsd_exchanges < 1.0 or spec.gsd_factors < 1.0:
+        raise HTTPException(400, detail="geometric standard deviations must be at least 1")
+    if any(not 0.0 <= k <= 100.0 for k in spec.percentiles):
+        raise HTTPException(400, detail="percentiles must be between 0 and 100")
+    budget = MAX_MC_SECONDS if spec.time_budget is None else max(0.0, min(spec.time_budget, MAX_MC_SECONDS))
+
+    pq = _get_authorized_query(origin, grants)
+    p = pq.get(process)
+    rx = _get_rx_by_ref_flow(p, ref_flow)
+    rf = rx.flow.external_ref
+    solver = _get_background_solver(pq, p, rf)
+    vectors = _authorize_matrix_lcia(pq, qty_org, quantity, grants)
+
+    with timed('compute'):
+        mc = MonteCarloLcia(solver, characterization_matrix(solver, vectors), gsd_exchanges=spec.gsd_exchanges,
+                            gsd_factors=spec.gsd_factors, seed=spec.seed)
+        det = mc.deterministic(p.external_ref, rf)
+        scores, truncated = mc.run(p.external_ref, rf, spec.samples, budget)
+
+    with timed('serialize'):
+        detailed = 'exchange' in pq.authorized_interfaces()
+        results = []
+        for k, vec in enumerate(vectors):
+            col = scores[:, k]
+            mean, std, pcts = distribution(col, spec.percentiles)
+            results.append(MonteCarloResult(quantity=vec.quantity.external_ref, deterministic=float(det[k]),
+                                            samples=len(col), truncated=truncated, mean=mean, std=std,
+                                            percentiles=pcts,
+                                            values=[float(v) for v in col] if detailed else []))
+        return results
+
+
+@app.post("/{origin}/{process}/scenarios/{quantity}", response_model=ScenarioBatchResult)
+@app.post("/{origin}/{process}/scenarios/{qty_org}/{quantity}", response_model=ScenarioBatchResult)
+@app.post("/{origin}/{process}/{ref_flow}/scenarios/{quantity}", response_model=ScenarioBatchResult)
+@app.post("/{origin}/{process}/{ref_flow}/scenarios/{qty_org}/{quantity}", response_model=ScenarioBatchResult)
+def post_scenario_lcia(origin: str, process: str, quantity: str, batch: ScenarioRequest, ref_flow: str = None,
+                       qty_org: str = None, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    What-if LCIA of a background node: each scenario overrides some of the node's direct exchange values.  All
+    scenarios are scored together from the unit scores of the node's dependencies (see libs/scenarios.py).  Each
+    scenario is metered as a sys_lci.
+    :param origin:
+    :param process:
+    :param quantity:
+    :param batch: scenarios, and whether to report per-exchange contributions (requires an exchange grant)
+    :param ref_flow:
+    :param qty_org:
+    :param grants:
+    :return:
+    """
+    if len(batch.scenarios) > MAX_SCENARIOS:
+        raise HTTPException(400, detail=f"Batch exceeds {MAX_SCENARIOS} scenarios")
+    pq = _get_authorized_query(origin, grants)
+    if batch.detailed and 'exchange' not in pq.authorized_interfaces():
+        raise HTTPException(403, detail="Detailed scenario results require an exchange grant")
+    p = pq.get(process)
+    rx = _get_rx_by_ref_flow(p, ref_flow)
+    rf = rx.flow.external_ref
+    solver = _get_background_solver(pq, p, rf)
+    vectors = _authorize_matrix_lcia(pq, qty_org, quantity, grants)
+    for _ in batch.scenarios:
+        pq.authorize('background', 'sys_lci')
+
+    with timed('compute'):
+        tables = cat.unit_scores(pq.origin, [vec.quantity for vec in vectors])
         try:
-            qq = cat.lcia_engine.get_canonical(quantity)
-        except EntityNotFound:
-            raise HTTPException(404, detail=f"Quantity {quantity} not found")
-        query = _get_authorized_query(qq.origin, token)
-    else:
-        query = _get_authorized_query(qty_org, token)
-        qq = query.get_canonical(quantity)
+            sb = ScenarioBatch.from_node(solver, tables, vectors, p, rx)
+        except ScenarioError as e:
+            raise HTTPException(409, detail=str(e))
+        v, errors = sb.values(batch.scenarios)
+        scores = sb.scores(v)
+        base = sb.scores(sb.base.reshape(1, -1))[0]
+
+    with timed('serialize'):
+        results = []
+        for i, scenario in enumerate(batch.scenarios):
+            if errors[i] is not None:
+                results.append(ScenarioResult(name=scenario.name, error=errors[i]))
+                continue
+            res = ScenarioResult(name=scenario.name, results=[float(r) for r in scores[i]])
+            if batch.detailed:
+                res.details = [ScenarioExchangeScore(flow=x.flow.external_ref, direction=x.direction,
+                                                     termination=None if x.termination is None else str(x.termination),
+                                                     value=float(v[i, j]),
+                                                     results=[float(u) * float(v[i, j]) for u in sb.unit[j]])
+                               for j, x in enumerate(sb.exchanges)]
+            results.append(res)
+        return ScenarioBatchResult(origin=pq.origin, process=p.external_ref, ref_flow=rf,
+                                   quantities=[vec.quantity.external_ref for vec in vectors],
+                                   base=[float(b) for b in base], scenarios=results)
+
+
+def _get_lcia_quantity(qty_org, quantity, grants):
+    """
+    :return: authorized query for the quantity's origin, canonical quantity
+    """
+    if qty_org is not None:
+        query = _get_authorized_query(qty_org, grants)  # before we go looking in the origin
+        query.authorize('quantity', 'get_canonical')  # as query.get_canonical(quantity) was, cached or not
+    try:
+        qq, _ = cat.canonical_quantity(qty_org, quantity)
+    except EntityNotFound:
+        raise HTTPException(404, detail=f"Quantity {quantity} not found")
+    if qty_org is None:
+        query = _get_authorized_query(qq.origin, grants)
+    return query, qq
+
 
-    return do_lcia(query, qq, lci)
+def _run_process_lcia(qty_org, quantity, grants, lci, key=None):
+    query, qq = _get_lcia_quantity(qty_org, quantity, grants)
+    with timed('compute'):
+        return do_lcia(query, qq, lci, key=key)
 
 
 @app.post("/{origin}/{process}/lcia/{quantity}", response_model=List[DetailedLciaResult])  # SHOOP
@@ -691,8 +1204,8 @@ def _run_process_lcia(qty_org, quantity, token, lci):
 @app.post("/{origin}/{process}/{ref_flow}/lcia/{quantity}", response_model=List[DetailedLciaResult])
 @app.post("/{origin}/{process}/{ref_flow}/lcia/{qty_org}/{quantity}", response_model=List[DetailedLciaResult])
 def post_observed_remote_lcia(origin: str, process: str, quantity: str, observed: List[DirectedFlow],
-                              ref_flow: str = None, qty_org: str = None,
-                              token: Optional[str] = Depends(oauth2_scheme)):
+                              ref_flow: str = None, qty_org: str = None, incremental: bool = False,
+                              grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
     A variant that performs bg_lcia on a node, excluding observed child flows (supplied in POSTDATA)
     :param origin:
@@ -701,20 +1214,25 @@ def post_observed_remote_lcia(origin: str, process: str, quantity: str, observed
     :param observed: a list of DirectedFlows that get passed to sys_lci
     :param ref_flow:
     :param qty_org:
-    :param token:
+    :param incremental: [False] subtract the observed flows' cached upstream LCIs from the node's cached LCI, instead
+     of solving the unobserved system from scratch. Same numbers, up to round-off; exchanges may come in another order
+    :param grants:
     :return:
     """
-    pq = _get_authorized_query(origin, token)
+    pq = _get_authorized_query(origin, grants)
     p = pq.get(process)
     rx = _get_rx_by_ref_flow(p, ref_flow)
-    lci = list(p.unobserved_lci(observed, ref_flow=rx))
+    with timed('compute'):
+        lci = pq.unobserved_lci(p, observed, ref_flow=rx, incremental=incremental)
 
-    ress = _run_process_lcia(qty_org, quantity, token, lci)
+    ress = _run_process_lcia(qty_org, quantity, grants, lci,
+                             key=(pq.origin, p.external_ref, rx.flow.external_ref, observed_key(observed)))
 
-    if 'exchange' in pq.authorized_interfaces():
-        return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
-    else:
-        return [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
+    with timed('serialize'):
+        if 'exchange' in pq.authorized_interfaces():
+            return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
+        else:
+            return [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
 
 
 """TO WRITE:
@@ -730,10 +1248,10 @@ exchange interface
 
 @app.get("/{origin}/{process}/exchanges", response_model=List[Exchange])  # SHOOP
 def get_exchanges(origin, process, type: str = None, flow: str = None,
-                  token: Optional[str] = Depends(oauth2_scheme)):
+                  grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     if type and (type not in EXCHANGE_TYPES):
         raise HTTPException(400, detail=f"Cannot understand type {type}")
-    query = _get_authorized_query(origin, token)
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     exch = p.exchanges(flow=flow)
     return list(generate_pydantic_exchanges(exch, type=type))
@@ -741,8 +1259,8 @@ def get_exchanges(origin, process, type: str = None, flow: str = None,
 
 @app.get("/{origin}/{process}/exchanges/{flow}", response_model=List[ExchangeValues])  # SHOOP
 def get_exchange_values(origin, process, flow: str,
-                        token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                        grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     exch = p.exchange_values(flow=flow)
     return list(ExchangeValues.from_ev(x) for x in exch)
@@ -751,8 +1269,8 @@ def get_exchange_values(origin, process, flow: str,
 @app.get("/{origin}/{process}/inventory", response_model=List[AllocatedExchange])
 @app.get("/{origin}/{process}/{ref_flow}/inventory", response_model=List[AllocatedExchange])
 def get_inventory(origin, process, ref_flow: str = None,
-                  token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                  grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rx = _get_rx_by_ref_flow(p, ref_flow)
 
@@ -796,8 +1314,8 @@ every term manager the set of default contexts... what other differences exist?
 @app.get('/{origin}/{process}/{ref_flow}/ad', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/ad', response_model=List[AllocatedExchange])
 def get_ad(origin: str, process: str, ref_flow: str = None,
-           token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+           grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.ad(ref_flow=rf))
@@ -806,8 +1324,8 @@ def get_ad(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/bf', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/bf', response_model=List[AllocatedExchange])
 def get_bf(origin: str, process: str, ref_flow: str = None,
-           token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+           grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.bf(ref_flow=rf))
@@ -816,8 +1334,8 @@ def get_bf(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/dependencies', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/dependencies', response_model=List[AllocatedExchange])
 def get_dependencies(origin: str, process: str, ref_flow: str = None,
-                     token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                     grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.dependencies(ref_flow=rf))
@@ -826,17 +1344,17 @@ def get_dependencies(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/emissions', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/emissions', response_model=List[AllocatedExchange])
 def get_emissions(origin: str, process: str, ref_flow: str = None,
-                  token: Optional[str] = Depends(oauth2_scheme)):
+                  grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
     """
     This returns a list of elementary exchanges from the process+reference flow pair.
     :param origin:
     :param process:
     :param ref_flow:
-    :param token:
+    :param grants:
     :return:
     """
 
-    query = _get_authorized_query(origin, token)
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.emissions(ref_flow=rf))
@@ -845,8 +1363,8 @@ def get_emissions(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/cutoffs', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/cutoffs', response_model=List[AllocatedExchange])
 def get_cutoffs(origin: str, process: str, ref_flow: str = None,
-                token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.cutoffs(ref_flow=rf))
@@ -855,24 +1373,112 @@ def get_cutoffs(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/lci', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/lci', response_model=List[AllocatedExchange])
 def get_lci(origin: str, process: str, ref_flow: str = None,
-            token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+            grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
-    return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in p.lci(ref_flow=rf))
+    with timed('compute'):
+        lci = list(p.lci(ref_flow=rf))
+    with timed('serialize'):
+        return list(AllocatedExchange.from_inv(x, ref_flow=rf.flow.external_ref) for x in lci)
+
+
+def _sys_lcis(query, demands):
+    """
+    sys_lci for each demand, solved together against the origin's cached factorization if it has a flat background
+    """
+    solver = cat.background_solver(query.origin)
+    if solver is None:
+        return [list(query.sys_lci(demand=demand)) for demand in demands]
+    for _ in demands:
+        query.authorize('background', 'sys_lci')
+    return solver.sys_lci(demands)
 
 
 @app.post('/{origin}/sys_lci', response_model=List[UnallocatedExchange])
-def sys_lci(origin: str, demand: List[UnallocatedExchange], token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
-    return list(UnallocatedExchange.from_inv(x) for x in query.sys_lci(demand=demand))
+def sys_lci(origin: str, demand: List[UnallocatedExchange], grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
+    with timed('compute'):
+        lci = _sys_lcis(query, [demand])[0]
+    with timed('serialize'):
+        return list(UnallocatedExchange.from_inv(x) for x in lci)
+
+
+@app.post('/{origin}/sys_lci/batch', response_model=List[List[UnallocatedExchange]])
+def sys_lci_batch(origin: str, demands: List[List[UnallocatedExchange]],
+                  grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    Many demand vectors in one request, solved together as multiple right-hand sides.  Metered as one sys_lci per
+    demand.
+    :param origin:
+    :param demands: a list of demands, each as for sys_lci
+    :param grants:
+    :return: one LCI per demand, in order
+    """
+    if len(demands) > MAX_SYS_LCI_DEMANDS:
+        raise HTTPException(400, detail=f"Batch exceeds {MAX_SYS_LCI_DEMANDS} demands")
+    query = _get_authorized_query(origin, grants)
+    with timed('compute'):
+        lcis = _sys_lcis(query, demands)
+    with timed('serialize'):
+        return [list(UnallocatedExchange.from_inv(x) for x in lci) for lci in lcis]
+
+
+@app.post('/{origin}/batch_lcia', response_model=List[BatchLciaRow])
+def post_batch_lcia(origin: str, batch: BatchLciaRequest, grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    """
+    Score many nodes against many quantities in one request.  Auth happens once, each quantity is resolved (and each
+    LCIA method expanded into its categories) once, and each node's LCI is computed once and reused for every
+    quantity. Characterization lookups are memoized on the flow refs of the node query, which are shared across
+    nodes.
+    :param origin:
+    :param batch: nodes, quantities, and optionally qty_org
+    :param grants:
+    :return: one BatchLciaRow per node, with results in quantity order (Detailed or Summary per authorization)
+    """
+    if len(batch.nodes) * len(batch.quantities) > MAX_BATCH_LCIA:
+        raise HTTPException(400, detail=f"Batch exceeds {MAX_BATCH_LCIA} node-quantity pairs")
+    pq = _get_authorized_query(origin, grants)
+    detailed = 'exchange' in pq.authorized_interfaces()
+
+    methods = []
+    for quantity in batch.quantities:
+        query, qq = _get_lcia_quantity(batch.qty_org, quantity, grants)
+        methods.append((query, qq, lcia_categories(query, qq)))
+
+    rows = []
+    for node in batch.nodes:
+        try:
+            p = pq.get(node.process)
+            rx = _get_rx_by_ref_flow(p, node.ref_flow)
+        except EntityNotFound:
+            rows.append(BatchLciaRow(process=node.process, ref_flow=node.ref_flow, error='process not found'))
+            continue
+        except HTTPException as e:
+            rows.append(BatchLciaRow(process=node.process, ref_flow=node.ref_flow, error=e.detail))
+            continue
+
+        key = (pq.origin, p.external_ref, rx.flow.external_ref)
+        with timed('compute'):
+            lci = list(p.lci(rx))
+            ress = []
+            for query, qq, qs in methods:
+                ress.extend(do_lcia(query, qq, lci, key=key, categories=qs))
+
+        with timed('serialize'):
+            if detailed:
+                results = [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
+            else:
+                results = [SummaryLciaResult.from_lcia_result(p, res) for res in ress]
+        rows.append(BatchLciaRow(process=node.process, ref_flow=rx.flow.external_ref, results=results))
+    return rows
 
 
 @app.get('/{origin}/{process}/{ref_flow}/consumers', response_model=List[AllocatedExchange])
 @app.get('/{origin}/{process}/consumers', response_model=List[AllocatedExchange])
 def get_consumers(origin: str, process: str, ref_flow: str = None,
-                  token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                  grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     return list(ReferenceExchange.from_exchange(x) for x in p.consumers(ref_flow=rf))
@@ -881,8 +1487,8 @@ def get_consumers(origin: str, process: str, ref_flow: str = None,
 @app.get('/{origin}/{process}/{ref_flow}/foreground', response_model=List[ExchangeValues])
 @app.get('/{origin}/{process}/foreground', response_model=List[ExchangeValues])
 def get_foreground(origin: str, process: str, ref_flow: str = None,
-                   token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                   grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     p = _get_typed_entity(query, process, 'process')
     rf = _get_rx_by_ref_flow(p, ref_flow)
     fg = p.foreground(ref_flow=rf)
@@ -927,8 +1533,8 @@ Applicable routes:
 
 @app.get('/{origin}/{flow_id}/cf/{quantity_id}', response_model=float)
 def get_cf(origin: str, flow_id: str, quantity_id: str, context: str = None, locale: str = None,
-           token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+           grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     f = _get_typed_entity(query, flow_id, 'flow')
     if context is not None:
         context = query.get_context(context)
@@ -938,8 +1544,8 @@ def get_cf(origin: str, flow_id: str, quantity_id: str, context: str = None, loc
 
 @app.get('/{origin}/{flow_id}/profile', response_model=List[Characterization])
 def get_flow_profile(origin: str, flow_id: str, quantity: str = None, context: str = None,
-                     token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                     grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     f = _get_typed_entity(query, flow_id, 'flow')
     if quantity is not None:
         quantity = _get_typed_entity(query, quantity, 'quantity')
@@ -950,8 +1556,8 @@ def get_flow_profile(origin: str, flow_id: str, quantity: str = None, context: s
 
 @app.get('/{origin}/{quantity_id}/norm', response_model=Normalizations)
 def get_quantity_norms(origin: str, quantity_id: str,
-                       token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                       grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     q = _get_typed_entity(query, quantity_id, 'quantity')
     return Normalizations.from_q(q)
 
@@ -959,8 +1565,8 @@ def get_quantity_norms(origin: str, quantity_id: str,
 @app.get('/{origin}/{quantity_id}/factors', response_model=List[Characterization])
 @app.get('/{origin}/{quantity_id}/factors/{flowable}', response_model=List[Characterization])
 def get_quantity_norms(origin: str, quantity_id: str, flowable: str = None,
-                       token: Optional[str] = Depends(oauth2_scheme)):
-    query = _get_authorized_query(origin, token)
+                       grants: List[AuthorizationGrant] = Depends(get_auth_grants)):
+    query = _get_authorized_query(origin, grants)
     q = _get_typed_entity(query, quantity_id, 'quantity')
     enum = q.factors(flowable=flowable)
 
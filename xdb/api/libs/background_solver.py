@@ -0,0 +1,239 @@
+"""
+Cached factorizations of an origin's flat (Tarjan) background, for solving many demands at once.
+
+The flat background partitions the technology matrix into a foreground block Af (with dependencies Ad on the
+background and emissions Bf) and a background block A (with emissions B).  For a set of demand columns D = [Df; Dd]:
+    Xf = (I - Af)^-1 Df
+    Xd = (I - A)^-1 (Ad Xf + Dd)
+    LCI = B Xd + Bf Xf
+Both (I - Af) and (I - A) are factorized once, on first use, and the factorizations are shared across requests; every
+demand (or block of demands) after that costs only triangular solves.  The same factorizations serve transposed
+solves for unit scores (see lcia_tables.py).
+"""
+
+from antelope import comp_dir, LinkingError
+from antelope.models import Exchange, UnallocatedExchange
+from antelope_core.archives import ArchiveError
+from antelope_core.exchanges import ExchangeValue
+
+from scipy.sparse import eye
+from scipy.sparse.linalg import splu
+import numpy as np
+import hashlib
+import threading
+
+
+def flat_background(query):
+    """
+    The FlatBackground behind an origin's background interface (built if necessary)
+    :param query: an un-metered catalog query
+    :return: background implementation, FlatBackground -- or None, None if no implementation can make one
+    """
+    for iface in query._iface('background'):
+        try:
+            iface.check_bg()
+            return iface, iface._flat
+        except (AttributeError, LinkingError, ArchiveError):  # not a flat background, or it couldn't be built
+            continue
+    return None, None
+
+
+class ExteriorFlowSpec(object):
+    """
+    Just enough of an exchange to be characterized: an exterior flow of the background, with the direction and
+    (canonical) context it is given in LCI results
+    """
+    type = 'context'
+    value = None
+
+    def __init__(self, flow, termination, direction):
+        self.flow = flow
+        self.termination = termination
+        self.direction = direction
+
+
+class _DemandSpec(object):
+    """
+    One demand vector, split the way FlatBackground.sys_lci splits it
+    """
+    def __init__(self):
+        self.node_ref = None
+        self.fg = []  # (index, signed value)
+        self.bg = []
+        self.missed = []  # (process, flow_ref, direction, term, value) passed through unchanged
+
+
+class BackgroundSolver(object):
+    block_size = 64  # demand columns solved together, to bound the size of the dense intermediates
+
+    def __init__(self, impl, flat):
+        """
+
+        :param impl: the origin's background implementation (for turning results into exchanges)
+        :param flat: its FlatBackground
+        """
+        self.impl = impl
+        self.flat = flat
+        self._lock = threading.Lock()
+        self._lu_a = None
+        self._lu_af = None
+        self._fingerprint = None
+        self._exterior = None
+
+    @property
+    def complete(self):
+        return self.flat._A is not None and self.flat.ndim > 0
+
+    @property
+    def fingerprint(self):
+        """
+        digest of the background's ordering-- results indexed by it are only valid against the same ordering
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            for seq in (self.flat.fg, self.flat.bg, self.flat.ex):
+                for t in seq:
+                    h.update(('%s|%s|%s\n' % (t.term_ref, t.flow_ref, t.direction)).encode())
+                h.update(b'--\n')
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def exterior_flows(self):
+        """
+        :return: an ExteriorFlowSpec for each row of B, in order
+        """
+        if self._exterior is None:
+            flat = self.flat
+            self._exterior = [ExteriorFlowSpec(self.impl[t.flow_ref], flat.context_map.get(t.term_ref),
+                                               comp_dir(t.direction)) for t in flat.ex]
+        return self._exterior
+
+    def _factorize(self):
+        with self._lock:
+            if self._lu_af is None:
+                if self.complete:
+                    self._lu_a = splu((eye(self.flat.ndim) - self.flat._A).tocsc())
+                if self.flat.pdim > 0:
+                    self._lu_af = splu((eye(self.flat.pdim) - self.flat._af).tocsc())
+                else:
+                    self._lu_af = False
+
+    def solve_bg(self, rhs, trans=False):
+        """
+        (I - A)^-1 rhs, or (I - A)^-T rhs
+        """
+        if self._lu_af is None:
+            self._factorize()
+        if self._lu_a is None:
+            return np.zeros((self.flat.ndim,) + rhs.shape[1:])
+        return self._lu_a.solve(np.asarray(rhs, dtype=float), trans='T' if trans else 'N')
+
+    def solve_fg(self, rhs, trans=False):
+        """
+        (I - Af)^-1 rhs, or (I - Af)^-T rhs
+        """
+        if self._lu_af is None:
+            self._factorize()
+        if self._lu_af is False:
+            return np.zeros((self.flat.pdim,) + rhs.shape[1:])
+        return self._lu_af.solve(np.asarray(rhs, dtype=float), trans='T' if trans else 'N')
+
+    def activity_levels(self, process, ref_flow):
+        """
+        Scaling vectors for a unit of one node
+        :param process: external ref
+        :param ref_flow: flow external ref
+        :return: xf (pdim), xd (ndim)
+        """
+        flat = self.flat
+        key = (process, ref_flow)
+        if key in flat._bg_index:
+            xf = np.zeros(flat.pdim)
+            ed = np.zeros(flat.ndim)
+            ed[flat._bg_index[key]] = 1.0
+            return xf, self.solve_bg(ed)
+        ef = np.zeros(flat.pdim)
+        ef[flat._fg_index[key]] = 1.0  # KeyError if the node is not in the background
+        xf = self.solve_fg(ef)
+        if self.complete:
+            return xf, self.solve_bg(np.asarray(flat._ad.dot(xf)).reshape(flat.ndim))
+        return xf, np.zeros(flat.ndim)
+
+    def _parse_demand(self, demand):
+        flat = self.flat
+        spec = _DemandSpec()
+        for exch in demand:
+            if isinstance(exch, Exchange):  # the model
+                x = exch
+            else:
+                x = UnallocatedExchange.from_inv(exch)
+            if spec.node_ref is None:  # just take the first one
+                spec.node_ref = x.process
+            if x.type == 'context':
+                spec.missed.append((x.process, x.flow.external_ref, x.direction, tuple(x.context), x.value))
+            elif x.termination is None:
+                spec.missed.append((x.process, x.flow.external_ref, x.direction, None, x.value))
+            else:
+                key = (x.termination, x.flow.external_ref)
+                if key in flat._fg_index:
+                    ind = flat._fg_index[key]
+                    spec.fg.append((ind, x.value * self._check_dirn(flat.fg[ind], x)))
+                elif key in flat._bg_index:
+                    ind = flat._bg_index[key]
+                    spec.bg.append((ind, x.value * self._check_dirn(flat.bg[ind], x)))
+                else:
+                    spec.missed.append((x.process, key[1], x.direction, key[0], x.value))
+        return spec
+
+    @staticmethod
+    def _check_dirn(term_ref, exch):
+        if comp_dir(exch.direction) == term_ref.direction:
+            return 1
+        return -1
+
+    def _solve_block(self, specs):
+        flat = self.flat
+        k = len(specs)
+        df = np.zeros((flat.pdim, k))
+        dd = np.zeros((flat.ndim, k))
+        for j, spec in enumerate(specs):
+            for i, v in spec.fg:
+                df[i, j] += v
+            for i, v in spec.bg:
+                dd[i, j] += v
+        xf = self.solve_fg(df)
+        bx = np.asarray(flat._bf.dot(xf)).reshape(flat.mdim, k)
+        if self.complete:
+            xd = self.solve_bg(np.asarray(flat._ad.dot(xf)).reshape(flat.ndim, k) + dd)
+            bx += np.asarray(flat._B.dot(xd)).reshape(flat.mdim, k)
+        return bx
+
+    def _exchanges(self, spec, column):
+        impl = self.impl
+        flat = self.flat
+        node = None
+        for i in np.flatnonzero(column):
+            term = flat.ex[i]
+            if node is None:
+                node = impl[spec.node_ref]
+            yield ExchangeValue(node, impl[term.flow_ref], comp_dir(term.direction),
+                                termination=flat.context_map.get(term.term_ref), value=float(column[i]))
+        for process, flow_ref, direction, term, value in spec.missed:
+            if node is None:
+                node = impl[process]
+            yield ExchangeValue(node, impl[flow_ref], direction, termination=term, value=value)
+
+    def sys_lci(self, demands):
+        """
+        LCI of each of several demand vectors, equivalent to the background's sys_lci for each one
+        :param demands: list of lists of exchanges (or exchange models)
+        :return: list of lists of ExchangeValues, in demand order
+        """
+        specs = [self._parse_demand(d) for d in demands]
+        results = []
+        for start in range(0, len(specs), self.block_size):
+            block = specs[start:start + self.block_size]
+            bx = self._solve_block(block)
+            for j, spec in enumerate(block):
+                results.append(list(self._exchanges(spec, bx[:, j])))
+        return results
@@ -0,0 +1,73 @@
+"""
+Hash index of a canonical quantity's characterization factors.
+
+The LCIA engine answers quantity_relation by canonicalizing the flowable, context and ref quantity, hunting through the
+CLookup for the context (then its subcontexts and parents), converting ref quantities and falling back on locales.  The
+common case-- one factor stored at exactly the requested context, in the requested ref quantity-- comes down to a dict
+lookup, so we build the dict once per canonical quantity:
+    (canonical flowable, canonical context) -> ref quantity, {locale: result}, GLO result
+The locale fallback (the requested locale if the CF has it, else GLO) is worked out ahead of time.
+
+The index only answers where the engine's answer is certain.  Anything else-- no CF at the exact context, more than one
+CF there, a CF in another ref quantity, the null context, or a locale with no GLO fallback-- gets None, and the caller
+asks the engine.
+"""
+
+from antelope import EntityNotFound
+from antelope_core.contexts import NullContext
+from antelope_core.implementations.quantity import QuantityConversion
+
+
+_AMBIGUOUS = 'ambiguous'  # more than one CF at the key; the engine has to choose
+
+
+class CfIndex(object):
+    def __init__(self, engine, quantity):
+        """
+
+        :param engine: the catalog's LciaEngine
+        :param quantity: a canonical quantity
+        """
+        self.quantity = quantity
+        self._engine = engine
+        self._factors = dict()
+        for cf in engine.factors_for_quantity(quantity):
+            try:
+                key = (engine.get_flowable(cf.flowable), engine[cf.context])  # as the engine filed it on import
+                rq = engine.get_canonical(cf.ref_quantity)
+            except (KeyError, EntityNotFound):
+                continue
+            if key in self._factors:
+                self._factors[key] = _AMBIGUOUS
+                continue
+            convs = {loc: QuantityConversion(cf.query(loc), query=quantity, context=key[1]) for loc in cf.locations}
+            self._factors[key] = (rq, convs, convs.get('GLO'))
+
+    def __len__(self):
+        return len(self._factors)
+
+    def lookup(self, flowable, ref_quantity, context, locale):
+        """
+        Same arguments as quantity_relation
+        :param flowable: str
+        :param ref_quantity:
+        :param context: tuple
+        :param locale:
+        :return: QuantityConversion, or None if the index can't answer for certain
+        """
+        cx = self._engine[context]
+        if cx is None or cx is NullContext:
+            return None
+        try:
+            entry = self._factors.get((self._engine.get_flowable(flowable), cx))
+            if entry is None or entry is _AMBIGUOUS:
+                return None
+            rq = self._engine.get_canonical(ref_quantity)
+        except (KeyError, EntityNotFound):
+            return None
+        if rq == self.quantity or rq != entry[0]:
+            return None
+        conv = entry[1].get(locale)
+        if conv is None:
+            return entry[2]
+        return conv
@@ -0,0 +1,65 @@
+"""
+Contribution analysis of a background node, from the background matrices.
+
+For a unit of node j with scaling vectors xf (foreground) and xd (background), and signed characterization factors c
+over the exterior flows:
+ - by process: node i contributes (c^T Bf)_i xf_i if it is in the foreground, (c^T B)_i xd_i if in the background
+ - by flow: exterior flow m contributes c_m (Bf xf + B xd)_m
+Either way the contributions sum to the node's LCIA score.  All of a method's categories are done together.
+"""
+
+from .lcia_tables import characterization_matrix
+
+import numpy as np
+
+
+BY_PROCESS = 'process'
+BY_FLOW = 'flow'
+
+
+def contributions(solver, vectors, process, ref_flow, by=BY_PROCESS):
+    """
+    :param solver: the origin's BackgroundSolver
+    :param vectors: list of CharacterizationVectors
+    :param process: external ref
+    :param ref_flow: flow external ref
+    :param by: 'process' or 'flow'
+    :return: (n x k) array of contributions, and a function mapping a row index to (kind, TermRef)
+    """
+    flat = solver.flat
+    c = characterization_matrix(solver, vectors)
+    xf, xd = solver.activity_levels(process, ref_flow)
+
+    if by == BY_FLOW:
+        lci = np.asarray(flat._bf.dot(xf)).reshape(flat.mdim)
+        if solver.complete:
+            lci = lci + np.asarray(flat._B.dot(xd)).reshape(flat.mdim)
+        return c * lci[:, None], lambda i: ('flow', flat.ex[i])
+
+    fg = np.asarray(flat._bf.T.dot(c)).reshape(flat.pdim, len(vectors)) * xf[:, None]
+    if solver.complete:
+        bg = np.asarray(flat._B.T.dot(c)).reshape(flat.ndim, len(vectors)) * xd[:, None]
+    else:
+        bg = np.zeros((flat.ndim, len(vectors)))
+
+    def _term(i):
+        if i < flat.pdim:
+            return 'process', flat.fg[i]
+        return 'process', flat.bg[i - flat.pdim]
+    return np.vstack([fg, bg]), _term
+
+
+def top_contributions(column, count):
+    """
+    :param column: contributions to one quantity
+    :param count: how many to keep
+    :return: indices of the largest nonzero contributions by magnitude, largest first; the remainder
+    """
+    nz = np.flatnonzero(column)
+    if count < len(nz):
+        keep = nz[np.argpartition(-np.abs(column[nz]), count - 1)[:count]] if count > 0 else nz[:0]
+    else:
+        keep = nz
+    keep = keep[np.argsort(-np.abs(column[keep]), kind='stable')]
+    remainder = float(column.sum() - column[keep].sum())
+    return keep, remainder
@@ -0,0 +1,74 @@
+"""
+A shared thread pool for fanning out per-category work (LCIA of one inventory against each of a method's impact
+categories, factor lookups for each category), with a cap on how much of the pool any one request may occupy.
+
+Results come back in the order of the inputs.  Each task runs in a copy of the submitting thread's context, so
+context-variable state (e.g. the request's phase timer) follows the work.  Characterization is done with numpy and
+shared catalog memos, which is why threads, and not processes, are used: the catalog's entities cannot be shared
+with a process pool without pickling them for every task.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextvars
+
+
+class CategoryExecutor(object):
+    def __init__(self, max_workers=8, per_request=4):
+        """
+
+        :param max_workers: size of the shared pool. 0 or 1 means no pool: everything runs in the caller's thread
+        :param per_request: most tasks any one map() call will have in the pool at once
+        """
+        self.max_workers = max_workers
+        self.per_request = max(1, per_request)
+        if max_workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='xdb-category')
+        else:
+            self._pool = None
+
+    def map(self, fn, items):
+        """
+        [fn(item) for item in items], evaluated concurrently.  The first exception raised by any call is re-raised
+        once the calls in flight have finished; no further calls are started after it.
+        :param fn:
+        :param items:
+        :return: list of results, in the order of items
+        """
+        items = list(items)
+        if self._pool is None or self.per_request == 1 or len(items) < 2:
+            return [fn(item) for item in items]
+
+        results = [None] * len(items)
+        pending = dict()
+        error = None
+        it = iter(enumerate(items))
+
+        def _submit():
+            try:
+                i, item = next(it)
+            except StopIteration:
+                return False
+            ctx = contextvars.copy_context()  # a context can only be entered by one thread at a time
+            pending[self._pool.submit(ctx.run, fn, item)] = i
+            return True
+
+        while len(pending) < self.per_request and _submit():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i = pending.pop(fut)
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+                if error is None:
+                    _submit()
+        if error is not None:
+            raise error
+        return results
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,56 @@
+"""
+Verified-token cache.
+
+Clients reuse the same bearer token for many requests, and each one costs an RS256 verification plus the construction
+of a stack of AuthorizationGrant models.  Once a token has been verified, we remember its grants under a digest of
+the token until the earlier of the token's own expiry and the expiry of the issuer key that signed it.  If the
+issuer's key is replaced, everything it signed gets dropped.
+"""
+
+from .lru_cache import LruCache
+
+import hashlib
+import time
+
+
+class GrantCache(object):
+    def __init__(self, maxsize=4096):
+        self._cache = LruCache(maxsize)
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """
+        :param token:
+        :return: a list of grants, or None if the token is not cached or its entry has expired
+        """
+        key = self._digest(token)
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expiry, issuer, grants = entry
+        if expiry <= time.time():
+            self._cache.pop(key)
+            return None
+        return list(grants)
+
+    def put(self, token, issuer, expiry, grants):
+        """
+        :param token:
+        :param issuer: issuer whose key verified the token
+        :param expiry: timestamp after which the entry must not be used
+        :param grants:
+        :return:
+        """
+        self._cache.put(self._digest(token), (expiry, issuer, tuple(grants)))
+
+    def invalidate_issuer(self, issuer):
+        return self._cache.discard_if(lambda k, v: v[1] == issuer)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,98 @@
+"""
+Incremental unobserved LCI.
+
+ProcessRef.unobserved_lci(observed) is sys_lci of the node's unobserved dependencies plus its unobserved emissions and
+cutoffs.  sys_lci is linear and the full LCI is the same construction with nothing observed, so
+    unobserved_lci = lci - sum over observed dependencies d of (sign_d * value_d * lci(d)) - observed exterior flows
+Every term on the right is a static per-node background result, cached on its own in the catalog's lci_cache, so a
+foreground tool that varies the observed set only pays for what changes.
+
+We only take this route when every dependency of the node resolves to a node of the origin's flat background; any
+dependency that sys_lci would pass through unsolved makes the subtraction inexact, and the caller recomputes.
+"""
+
+from antelope import comp_dir, ExchangeRef
+
+
+# relative magnitude below which a difference is treated as exact cancellation.  The cached LCIs are themselves only
+# converged to about 1e-8 (FlatBackground iterates to a relative threshold), so anything tighter keeps solver noise
+RESIDUE = 1e-6
+
+
+def _key(x):
+    return x.flow.external_ref, x.direction, str(x.termination)
+
+
+def dependency_sign(flat, x):
+    """
+    the sign sys_lci gives a dependency exchange, or None if its termination is not a background node
+    """
+    key = (x.termination, x.flow.external_ref)
+    if key in flat._fg_index:
+        term = flat.fg[flat._fg_index[key]]
+    elif key in flat._bg_index:
+        term = flat.bg[flat._bg_index[key]]
+    else:
+        return None
+    return 1.0 if comp_dir(x.direction) == term.direction else -1.0
+
+
+def incremental_unobserved_lci(query, flat, process, obs, ref_flow, calls=None):
+    """
+    :param query: the query the process came from
+    :param flat: the origin's FlatBackground
+    :param process: ProcessRef
+    :param obs: set of observed (flow.external_ref, direction)
+    :param ref_flow: reference exchange
+    :param calls: [None] list to which the name of each background query made is appended, for metering
+    :return: list of ExchangeRefs, or None if the result cannot be obtained incrementally
+    """
+    if calls is None:
+        calls = []
+    calls.append('dependencies')
+    deps = list(process.dependencies(ref_flow=ref_flow))
+    subtract = []  # (scale, node, ref_flow)
+    for x in deps:
+        sign = dependency_sign(flat, x)
+        if sign is None:
+            return None
+        if (x.flow.external_ref, x.direction) in obs:
+            subtract.append((sign * x.value, x.termination, x.flow.external_ref))
+
+    values = dict()
+    exchs = dict()
+    scale = dict()
+    calls.append('lci')
+    for x in process.lci(ref_flow=ref_flow):
+        k = _key(x)
+        values[k] = values.get(k, 0.0) + x.value
+        scale[k] = max(scale.get(k, 0.0), abs(x.value))
+        exchs.setdefault(k, x)
+
+    def _sub(_x, _v):
+        _k = _key(_x)
+        values[_k] = values.get(_k, 0.0) - _v
+        scale[_k] = max(scale.get(_k, 0.0), abs(_v))
+        exchs.setdefault(_k, _x)
+
+    for s, node, rf in subtract:
+        calls.append('lci')
+        for x in query.lci(node, ref_flow=rf):
+            _sub(x, s * x.value)
+
+    calls.append('emissions')
+    for x in process.emissions(ref_flow=ref_flow):
+        if (x.flow.external_ref, x.direction) in obs:
+            _sub(x, x.value)
+    calls.append('cutoffs')
+    for x in process.cutoffs(ref_flow=ref_flow):
+        if (x.flow.external_ref, x.direction) in obs:
+            _sub(x, x.value)
+
+    lci = []
+    for k, x in exchs.items():
+        v = values[k]
+        if abs(v) <= RESIDUE * scale[k]:
+            continue
+        lci.append(ExchangeRef(process, x.flow, x.direction, value=v, termination=x.termination))
+    return lci
@@ -0,0 +1,207 @@
+"""
+Background jobs for long-running computations.
+
+A job is a closure that produces a JSON-able result.  Jobs wait in a bounded queue and are run by a small pool of
+worker threads; submitting to a full queue fails rather than piling up work.  When a job finishes, its status and
+result are written to a file under the job directory, so results survive a restart until they expire.  Finished jobs
+(and their files) are removed once they are older than the TTL.
+
+Authorization and metering are the caller's business, at submit time; the job runs unmetered (see
+xdb_query.unmetered) under the same grants.
+"""
+
+from .xdb_query import unmetered
+
+from fastapi.encoders import jsonable_encoder
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job(object):
+    def __init__(self, user, kind, func, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.user = user
+        self.kind = kind
+        self.func = func
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def serialize(self):
+        return {'id': self.id, 'user': self.user, 'kind': self.kind, 'status': self.status,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished,
+                'error': self.error}
+
+    @classmethod
+    def from_json(cls, j):
+        job = cls(j['user'], j['kind'], None, job_id=j['id'])
+        for k in ('status', 'submitted', 'started', 'finished', 'error'):
+            setattr(job, k, j[k])
+        return job
+
+
+class JobQueue(object):
+    def __init__(self, job_dir, workers=2, max_queued=100, ttl=3600.0):
+        """
+
+        :param job_dir: where finished jobs are written
+        :param workers: number of worker threads
+        :param max_queued: jobs waiting beyond this many are refused
+        :param ttl: seconds a finished job is kept
+        """
+        self.job_dir = job_dir
+        self.ttl = ttl
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queued)
+        os.makedirs(job_dir, exist_ok=True)
+        self._threads = [threading.Thread(target=self._work, name='xdb-job-%d' % i, daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def _filename(self, job_id):
+        return os.path.join(self.job_dir, job_id + '.json')
+
+    def submit(self, user, kind, func, *args, **kwargs):
+        """
+        :param user: owner of the job
+        :param kind: label, e.g. 'sys_lci'
+        :param func: called with args and kwargs in a worker; must return something jsonable_encoder can handle
+        :return: Job
+        """
+        self.expire()
+        job = Job(user, kind, lambda: func(*args, **kwargs))
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFull
+        return job
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job.status = RUNNING
+            job.started = time.time()
+            result = None
+            error = None
+            try:
+                with unmetered():
+                    result = jsonable_encoder(job.func())
+                status = DONE
+            except Exception as e:
+                logging.exception('job %s failed' % job.id)
+                error = '%s: %s' % (type(e).__name__, getattr(e, 'detail', e))
+                status = FAILED
+            job.func = None
+            finished = time.time()
+            try:
+                self._save(job, result, status=status, finished=finished, error=error)
+            except (OSError, TypeError, ValueError) as e:
+                status = FAILED
+                error = 'result could not be stored: %s' % e
+                try:
+                    self._save(job, None, status=status, finished=finished, error=error)
+                except (OSError, TypeError, ValueError):
+                    logging.exception('job %s could not be stored' % job.id)
+            # the file is in place before anyone polling can see the job finished
+            job.error = error
+            job.finished = finished
+            job.status = status
+
+    def _save(self, job, result, **final):
+        """
+        Write the job's record and result, atomically
+        :param job:
+        :param result:
+        :param final: status, finished and error to record in place of the job's current ones
+        :return:
+        """
+        record = job.serialize()
+        record.update(final)
+        tmp = self._filename(job.id) + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'job': record, 'result': result}, fp)
+        os.replace(tmp, self._filename(job.id))
+
+    def get(self, job_id):
+        """
+        :return: Job, or None if unknown or expired
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            try:
+                with open(self._filename(job_id)) as fp:
+                    job = Job.from_json(json.load(fp)['job'])
+            except (OSError, ValueError, KeyError):
+                return None
+        if job.finished is not None and job.finished + self.ttl < time.time():
+            self._discard(job_id)
+            return None
+        return job
+
+    def result(self, job_id):
+        with open(self._filename(job_id)) as fp:
+            return json.load(fp)['result']
+
+    def _discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        try:
+            os.remove(self._filename(job_id))
+        except OSError:
+            pass
+
+    def expire(self):
+        """
+        Drop finished jobs older than the TTL, including any left on disk by a previous run
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            stale = [k for k, j in self._jobs.items() if j.finished is not None and j.finished < cutoff]
+        for k in stale:
+            self._discard(k)
+        try:
+            for fn in os.listdir(self.job_dir):
+                path = os.path.join(self.job_dir, fn)
+                if fn.endswith('.json') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            counts = dict()
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+        counts['size'] = self._queue.qsize()
+        return counts
+
+    def close(self):
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
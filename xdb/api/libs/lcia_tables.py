@@ -0,0 +1,106 @@
+"""
+Materialized LCIA tables: unit scores for every process in an origin's background, for a given quantity.
+
+For a flat (Tarjan) background with foreground Af, Ad, Bf and background A, B, and a characterization vector c over
+its exterior flows, the unit scores of every background node come out of one transposed solve (using the origin's
+cached factorizations, see background_solver.py):
+    (I - A)^T s_bg = B^T c
+and those of every foreground node out of another:
+    (I - Af)^T s_fg = Bf^T c + Ad^T s_bg
+Several quantities are done together as multiple right-hand sides.  The characterization vector is taken from the
+catalog's CharacterizationVectors, so that table scores agree with live LCIA.
+
+Tables are written as .npz files under the catalog root, stamped with a fingerprint of the background's ordering so
+that a table is never applied to a background it was not built from.
+"""
+
+import numpy as np
+import hashlib
+import os
+
+
+TABLES_DIR = 'lcia_tables'
+
+
+def table_filename(root, origin, quantity):
+    qid = hashlib.sha1(('%s/%s' % (quantity.origin, quantity.external_ref)).encode()).hexdigest()
+    return os.path.join(root, TABLES_DIR, origin, qid + '.npz')
+
+
+class LciaTable(object):
+    """
+    Unit scores of one quantity for every (process, ref_flow) in one background
+    """
+    def __init__(self, quantity, fg_scores, bg_scores, fg_index, bg_index):
+        self.quantity = quantity
+        self._fg = fg_scores
+        self._bg = bg_scores
+        self._fg_index = fg_index
+        self._bg_index = bg_index
+
+    def score(self, process, ref_flow):
+        """
+        :return: unit score, or None if the node is not in the table
+        """
+        key = (process, ref_flow)
+        i = self._bg_index.get(key)
+        if i is not None:
+            return float(self._bg[i])
+        i = self._fg_index.get(key)
+        if i is not None:
+            return float(self._fg[i])
+        return None
+
+    @classmethod
+    def load(cls, filename, quantity, flat, fingerprint):
+        """
+        :return: an LciaTable, or None if the file is missing or was built from a different background
+        """
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename, allow_pickle=False) as d:
+            if str(d['fingerprint']) != fingerprint:
+                return None
+            return cls(quantity, d['fg'], d['bg'], flat._fg_index, flat._bg_index)
+
+
+def characterization_matrix(solver, vectors):
+    """
+    Signed characterization factors of the background's exterior flows, one column per quantity
+    :param solver: the origin's BackgroundSolver
+    :param vectors: list of CharacterizationVectors
+    :return: mdim x k array
+    """
+    specs = solver.exterior_flows()
+    c = np.zeros((solver.flat.mdim, len(vectors)))
+    for k, vec in enumerate(vectors):
+        cols = vec.columns(specs)
+        f = vec.factors()
+        c[:, k] = [f[col] for col in cols]
+    return c
+
+
+def build_lcia_tables(solver, vectors):
+    """
+    :param solver: the origin's BackgroundSolver
+    :param vectors: list of CharacterizationVectors
+    :return: fg scores (pdim x k), bg scores (ndim x k)
+    """
+    flat = solver.flat
+    c = characterization_matrix(solver, vectors)
+
+    rhs = np.asarray(flat._bf.T.dot(c)).reshape(flat.pdim, len(vectors))
+    if solver.complete:
+        s_bg = solver.solve_bg(np.asarray(flat._B.T.dot(c)), trans=True).reshape(flat.ndim, len(vectors))
+        rhs += np.asarray(flat._ad.T.dot(s_bg)).reshape(flat.pdim, len(vectors))
+    else:
+        s_bg = np.zeros((flat.ndim, len(vectors)))
+    s_fg = solver.solve_fg(rhs, trans=True).reshape(flat.pdim, len(vectors))
+    return s_fg, s_bg
+
+
+def save_lcia_table(filename, fingerprint, fg, bg):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = filename + '.tmp.npz'
+    np.savez_compressed(tmp, fingerprint=np.array(fingerprint), fg=fg, bg=bg)
+    os.replace(tmp, filename)
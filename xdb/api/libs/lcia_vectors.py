@@ -0,0 +1,157 @@
+"""
+Memoized, vectorized LCIA for background inventories.
+
+The core do_lcia() visits every exchange of an inventory and asks the flow for a characterization factor
+(flow.lookup_cf), then files the exchange into an LciaResult as a score, zero, cutoff or error.  For a given
+(quantity, locale, dist) that classification depends only on the exchange's flow, termination and direction, and
+background LCIs from the same origin share the same few thousand elementary flows-- so we remember it.
+
+A CharacterizationVector holds, per (flow, termination, direction) key, the classification, the QR result, and the
+signed characterization factor.  lcia() replays the core algorithm's LciaResult calls from the memo, in inventory order,
+so the DetailedLciaResult that comes out is the same as core do_lcia() would give.  factors() gives the signed
+characterization factors as an array, for callers that only want totals.
+"""
+
+from antelope import comp_dir, NoFactorsFound, ConversionReferenceMismatch, QuantityRequired
+from antelope_core.characterizations import QRResult
+from antelope_core.implementations.quantity import (QuantityConversion, CO2QuantityConversion,
+                                                    QuantityConversionError)
+from antelope_core.lcia_results import LciaResult
+
+import numpy as np
+import threading
+
+
+CUTOFF, ZERO, SCORE, ERROR = range(4)
+
+
+def _dirn_adjust(context_sense, exchange_direction):
+    """
+    same as core lcia_results: a factor applies as-is if the exchange runs in the sense of its context
+    """
+    if context_sense is None:
+        return 1.0
+    elif comp_dir(context_sense) == exchange_direction:
+        return 1.0
+    return -1.0
+
+
+def flow_key(x):
+    term = x.termination
+    try:
+        hash(term)
+    except TypeError:
+        term = str(term)
+    return x.flow.origin, x.flow.external_ref, term, x.direction
+
+
+class CharacterizationVector(object):
+    def __init__(self, quantity, locale='GLO', dist=2):
+        """
+
+        :param quantity: a canonical quantity ref
+        :param locale: ['GLO'] as for the quantity implementation's do_lcia
+        :param dist: [2] as for core do_lcia
+        """
+        self.quantity = quantity
+        self.locale = locale
+        self.dist = dist
+        self._index = dict()  # flow key -> column
+        self._kinds = []
+        self._qrrs = []
+        self._factors = []
+        self._array = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def _classify(self, x):
+        """
+        The body of core do_lcia's loop, minus the LciaResult
+        :param x:
+        :return: kind, qrr, signed factor
+        """
+        qrr = x.flow.lookup_cf(self.quantity, x.termination, self.locale, dist=self.dist)
+        if isinstance(qrr, QuantityConversion) or isinstance(qrr, QRResult):
+            if x.flow.quell_co2:
+                qrr = CO2QuantityConversion.copy(qrr)
+                kind = SCORE
+            elif qrr.value == 0:
+                return ZERO, qrr, 0.0
+            else:
+                kind = SCORE
+        elif isinstance(qrr, QuantityConversionError):
+            try:  # if it's down to a unit conversion, our flow could repair it
+                qrr = qrr.repair(x.flow)
+                kind = SCORE
+            except (NoFactorsFound, ConversionReferenceMismatch, QuantityRequired):
+                return ERROR, qrr, 0.0
+        elif qrr is None:
+            return CUTOFF, None, 0.0
+        else:
+            raise TypeError('Unknown qrr type %s' % (qrr,))
+        value = qrr.value
+        if value is None:
+            return kind, qrr, 0.0
+        return kind, qrr, float(value) * _dirn_adjust(qrr.context.sense, x.direction)
+
+    def columns(self, inventory):
+        """
+        Column of each inventory item, classifying any we have not seen.  Reference and 'self' exchanges get None.
+        :param inventory:
+        :return: list
+        """
+        cols = []
+        for x in inventory:
+            if x.type in ('reference', 'self'):
+                cols.append(None)
+                continue
+            key = flow_key(x)
+            col = self._index.get(key)
+            if col is None:
+                kind, qrr, factor = self._classify(x)
+                with self._lock:
+                    col = self._index.get(key)
+                    if col is None:
+                        col = self._index[key] = len(self._kinds)
+                        self._kinds.append(kind)
+                        self._qrrs.append(qrr)
+                        self._factors.append(factor)
+                        self._array = None
+            cols.append(col)
+        return cols
+
+    def factors(self):
+        a = self._array
+        if a is None:
+            with self._lock:
+                a = self._array = np.array(self._factors, dtype=float)
+        return a
+
+    def lcia(self, inventory, group=None):
+        """
+        Equivalent to core do_lcia(self.quantity, inventory, locale=self.locale, group=group, dist=self.dist)
+        :param inventory: list of exchanges
+        :param group: as for do_lcia
+        :return: LciaResult
+        """
+        if group is None:
+            group = lambda _x: _x.process
+        res = LciaResult(self.quantity)
+        for x, col in zip(inventory, self.columns(inventory)):
+            if col is None:
+                if x.type == 'reference':
+                    res.add_cutoff(x)
+                continue
+            kind = self._kinds[col]
+            if kind == SCORE:
+                res.add_score(group(x), x, self._qrrs[col])
+            elif kind == ZERO:
+                res.add_zero(x)
+            elif kind == CUTOFF:
+                res.add_cutoff(x)
+            else:
+                res.add_error(x, self._qrrs[col])
+        return res
+
@@ -0,0 +1,123 @@
+"""
+A small thread-safe LRU mapping with hit / miss accounting.  This is the building block for the server's various
+in-process caches, all of which exist because the underlying data are static.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class LruCache(object):
+    """
+    Bounded mapping that evicts least-recently-used entries.  Safe to share among FastAPI's threadpool workers.
+
+    By default every entry counts 1 against maxsize.  If weigh is given, each entry instead counts weigh(value), so
+    the bound can be expressed in e.g. exchanges rather than entries.  A value heavier than maxsize is not stored.
+    """
+    def __init__(self, maxsize=1024, weigh=None):
+        self._maxsize = maxsize
+        self._weigh = weigh
+        self._d = OrderedDict()  # key -> (weight, value)
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, key):
+        return key in self._d
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                _, value = self._d[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._d.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        w = 1 if self._weigh is None else self._weigh(value)
+        with self._lock:
+            if key in self._d:
+                self._weight -= self._d.pop(key)[0]
+            if w > self._maxsize:
+                return
+            self._d[key] = (w, value)
+            self._weight += w
+            while self._weight > self._maxsize:
+                _, (old, _) = self._d.popitem(last=False)
+                self._weight -= old
+                self.evictions += 1
+
+    def reweigh(self, key):
+        """
+        Recompute the weight of an entry whose value has grown (or shrunk) since it was put, evicting as needed
+        :param key:
+        :return:
+        """
+        if self._weigh is None:
+            return
+        with self._lock:
+            try:
+                old, value = self._d[key]
+            except KeyError:
+                return
+            w = self._weigh(value)
+            if w > self._maxsize:  # too heavy to keep, as for put
+                del self._d[key]
+                self._weight -= old
+                return
+            self._d[key] = (w, value)
+            self._weight += w - old
+            while self._weight > self._maxsize:
+                _, (old, _) = self._d.popitem(last=False)
+                self._weight -= old
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                w, value = self._d.pop(key)
+            except KeyError:
+                return default
+            self._weight -= w
+            return value
+
+    def discard_if(self, test):
+        """
+        Remove every entry for which test(key, value) is true
+        :param test:
+        :return: the number of entries removed
+        """
+        with self._lock:
+            doomed = [k for k, (w, v) in self._d.items() if test(k, v)]
+            for k in doomed:
+                self._weight -= self._d.pop(k)[0]
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+            self._weight = 0
+
+    def stats(self):
+        return {'size': len(self._d),
+                'weight': self._weight,
+                'maxsize': self._maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
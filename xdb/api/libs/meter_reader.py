@@ -15,47 +15,326 @@ and that is nontrivial, because the query isn't known at the time of auth- I mea
 being validated.
 
 The grant needs to be: userid, signer,
+
+Counting happens on FastAPI's threadpool, so the counters are striped across a fixed set of locks (one lock per
+shard of keys) and kept as plain lists rather than pydantic models.  Dirty counters are flushed in batches to a local
+SQLite file by a background thread, so totals (and what has been billed) survive a restart.
+
+Each flush also records the increments since the previous flush into hourly and daily usage buckets, keyed first by
+user, so a user's usage over a time window can be read from an index instead of walking every counter.  Hourly buckets
+are compacted away after a few days (the daily buckets carry the same counts), and daily buckets after about a year.
+Bucket times are flush times, so they are accurate to within the flush interval.
 """
 from antelope import ValuesAccessRequired, UpdateAccessRequired
 from antelope.models.auth import AuthorizationGrant
 
-from .models import QueryCounter, BillingCounter, UsageReport
+from .models import QueryCounter, BillingCounter, UsageReport, UsageBucket
 
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import sqlite3
+import threading
+import time
 
-class MeterReader(object):
+
+_ACCESS, _VALUES, _UPDATE = 0, 1, 2
+
+SPANS = {'hour': 3600, 'day': 86400}
+
+
+class MeterStore(object):
     """
-    Keep a set of QueryCounters and allow them to increment
+    Durable home for counter totals (one row per (user, origin, interface)) and for time-bucketed usage
     """
+    def __init__(self, path, hourly_retention=7*86400, daily_retention=400*86400):
+        """
+
+        :param path:
+        :param hourly_retention: [7 days] seconds to keep hourly buckets
+        :param daily_retention: [400 days] seconds to keep daily buckets
+        """
+        self._path = path
+        self._retention = {'hour': hourly_retention, 'day': daily_retention}
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS counters ('
+                         'user TEXT NOT NULL, origin TEXT NOT NULL, interface TEXT NOT NULL, '
+                         'n_access INTEGER NOT NULL DEFAULT 0, n_values INTEGER NOT NULL DEFAULT 0, '
+                         'n_update INTEGER NOT NULL DEFAULT 0, b_access INTEGER NOT NULL DEFAULT 0, '
+                         'b_values INTEGER NOT NULL DEFAULT 0, b_update INTEGER NOT NULL DEFAULT 0, '
+                         'PRIMARY KEY (user, origin, interface))')
+            conn.execute('CREATE TABLE IF NOT EXISTS usage ('
+                         'user TEXT NOT NULL, span TEXT NOT NULL, bucket INTEGER NOT NULL, '
+                         'origin TEXT NOT NULL, interface TEXT NOT NULL, '
+                         'n_access INTEGER NOT NULL DEFAULT 0, n_values INTEGER NOT NULL DEFAULT 0, '
+                         'n_update INTEGER NOT NULL DEFAULT 0, '
+                         'PRIMARY KEY (user, span, bucket, origin, interface))')
+            conn.execute('CREATE INDEX IF NOT EXISTS usage_by_bucket ON usage (span, bucket)')
+
+    @property
+    def path(self):
+        return self._path
+
+    @contextmanager
+    def _connect(self):
+        """
+        A connection for one transaction: committed (or rolled back) and then closed on exit
+        """
+        conn = sqlite3.connect(self._path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load(self):
+        with self._connect() as conn:
+            for row in conn.execute('SELECT user, origin, interface, n_access, n_values, n_update, '
+                                    'b_access, b_values, b_update FROM counters'):
+                yield tuple(row[:3]), list(row[3:6]), list(row[6:])
+
+    def write_counts(self, counts, deltas=None, when=None):
+        """
+        Write counter totals, and add the increments to the usage buckets containing 'when', in one transaction
+        :param counts: dict of key -> (access, values, update) totals
+        :param deltas: dict of key -> (access, values, update) increments since the last write
+        :param when: [now] epoch seconds
+        :return:
+        """
+        if when is None:
+            when = time.time()
+        with self._connect() as conn:
+            conn.executemany('INSERT INTO counters (user, origin, interface, n_access, n_values, n_update) '
+                             'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user, origin, interface) DO UPDATE SET '
+                             'n_access=excluded.n_access, n_values=excluded.n_values, n_update=excluded.n_update',
+                             [k + tuple(v) for k, v in counts.items()])
+            if deltas:
+                rows = []
+                for span, width in SPANS.items():
+                    bucket = int(when // width) * width
+                    rows.extend((k[0], span, bucket, k[1], k[2]) + tuple(v) for k, v in deltas.items() if any(v))
+                conn.executemany('INSERT INTO usage (user, span, bucket, origin, interface, n_access, n_values, '
+                                 'n_update) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                                 'ON CONFLICT (user, span, bucket, origin, interface) DO UPDATE SET '
+                                 'n_access=n_access + excluded.n_access, n_values=n_values + excluded.n_values, '
+                                 'n_update=n_update + excluded.n_update', rows)
+
+    def usage(self, user, start, end, span='day'):
+        """
+        Usage buckets for one user which begin in [start, end)
+        :param user:
+        :param start: epoch seconds
+        :param end: epoch seconds
+        :param span: 'hour' or 'day'
+        :return: generates UsageBuckets in time order
+        """
+        if span not in SPANS:
+            raise ValueError('unknown span %s' % span)
+        start = int(start // SPANS[span]) * SPANS[span]  # include the bucket containing start
+        with self._connect() as conn:
+            for row in conn.execute('SELECT bucket, origin, interface, n_access, n_values, n_update FROM usage '
+                                    'WHERE user=? AND span=? AND bucket>=? AND bucket<? '
+                                    'ORDER BY bucket, origin, interface', (user, span, start, end)):
+                yield UsageBucket(user=user, span=span, start=row[0], origin=row[1], interface=row[2],
+                                  access=row[3], values=row[4], update=row[5])
+
+    def compact(self, now=None):
+        """
+        Drop buckets that have aged out of retention
+        :param now:
+        :return: number of rows removed
+        """
+        if now is None:
+            now = time.time()
+        removed = 0
+        with self._connect() as conn:
+            for span, retention in self._retention.items():
+                removed += conn.execute('DELETE FROM usage WHERE span=? AND bucket<?',
+                                        (span, int(now - retention))).rowcount
+        return removed
+
+    def write_billed(self, billed):
+        with self._connect() as conn:
+            conn.executemany('UPDATE counters SET b_access=?, b_values=?, b_update=? '
+                             'WHERE user=? AND origin=? AND interface=?',
+                             [tuple(v) + k for k, v in billed.items()])
+
+
+class _Shard(object):
+    __slots__ = ('lock', 'counters', 'dirty')
+
     def __init__(self):
-        self._counter = dict()  # key = user,origin,interface; value = QueryCounter
-        self._billing = dict()  # "", value = BillingCounter
+        self.lock = threading.Lock()
+        self.counters = dict()  # key = user,origin,interface; value = [access, values, update]
+        self.dirty = set()
+
+
+class MeterReader(object):
+    """
+    Keep a set of query counters and allow them to increment
+    """
+    def __init__(self, store_path=None, flush_interval=30.0, shards=16):
+        """
+
+        :param store_path: [None] SQLite file for durable counters. If None, counters live only in memory.
+        :param flush_interval: [30.0] seconds between background flushes
+        :param shards: [16] number of independently-locked counter shards
+        """
+        self._shards = tuple(_Shard() for _ in range(shards))
+        self._user_keys = defaultdict(set)  # user -> set of counter keys
+        self._index_lock = threading.Lock()
+        self._flushed = dict()  # key -> totals as of the last flush; guarded by _flush_lock
+        self._compacted = 0.0
+        self._billing = dict()  # key = user,origin,interface; value = [access, values, update] already billed
+        self._billing_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._store = None
+        self._stop = threading.Event()
+        self._flusher = None
+        if store_path is not None:
+            self._store = MeterStore(store_path)
+            for key, counts, billed in self._store.load():
+                self._shard(key).counters[key] = counts
+                self._user_keys[key[0]].add(key)
+                self._flushed[key] = tuple(counts)
+                self._billing[key] = billed
+            self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                                             name='meter-flush', daemon=True)
+            self._flusher.start()
 
-    def _access(self, grant: AuthorizationGrant):
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _count(self, grant, field=None):
         key = (grant.user, grant.origin, grant.access)
-        if key not in self._counter:
-            self._counter[key] = QueryCounter(user=grant.user, origin=grant.origin, interface=grant.access)
-            self._billing[key] = BillingCounter(user=grant.user, origin=grant.origin, interface=grant.access)
-        return self._counter[key]
+        shard = self._shard(key)
+        with shard.lock:
+            c = shard.counters.get(key)
+            if c is None:
+                c = shard.counters[key] = [0, 0, 0]
+                with self._index_lock:
+                    self._user_keys[key[0]].add(key)
+            c[_ACCESS] += 1
+            if field is not None:
+                c[field] += 1
+            shard.dirty.add(key)
 
     def access(self, grant: AuthorizationGrant):
-        count = self._access(grant).query_access()
-        if count % 100 == 0:
-            print('grant %s passed %d queries' % (grant.display, count))
+        self._count(grant)
 
     def values(self, grant):
         if grant.values is False:
             raise ValuesAccessRequired
-        self._access(grant).query_values()
+        self._count(grant, _VALUES)
 
     def update(self, grant):
         if grant.update is False:
             raise UpdateAccessRequired
-        self._access(grant).query_update()
+        self._count(grant, _UPDATE)
+
+    def user_keys(self, user):
+        with self._index_lock:
+            return set(self._user_keys.get(user, ()))
+
+    def snapshot(self, user=None):
+        """
+        A consistent copy of the counters, taken with every relevant shard locked
+        :param user: [None] restrict to a single user's counters (found from the user index)
+        :return: dict of key -> (access, values, update)
+        """
+        if user is None:
+            shards = self._shards
+            keys = None
+        else:
+            keys = self.user_keys(user)
+            n = len(self._shards)
+            shards = [self._shards[i] for i in sorted({hash(k) % n for k in keys})]  # fixed lock order
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            if keys is None:
+                return {k: tuple(v) for shard in shards for k, v in shard.counters.items()}
+            return {k: tuple(self._shard(k).counters[k]) for k in keys}
+        finally:
+            for shard in shards:
+                shard.lock.release()
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+                if time.time() - self._compacted > SPANS['hour']:
+                    self._compacted = time.time()
+                    self._store.compact()
+            except sqlite3.Error as e:
+                logging.error('meter flush failed: %s' % e)
+
+    def flush(self):
+        """
+        Write dirty counters to the store in one batch
+        :return: number of counters written
+        """
+        if self._store is None:
+            return 0
+        with self._flush_lock:
+            batch = dict()
+            for shard in self._shards:
+                with shard.lock:
+                    for k in shard.dirty:
+                        batch[k] = tuple(shard.counters[k])
+                    shard.dirty.clear()
+            if batch:
+                deltas = dict()
+                for k, v in batch.items():
+                    prev = self._flushed.get(k, (0, 0, 0))
+                    deltas[k] = tuple(a - b for a, b in zip(v, prev))
+                try:
+                    self._store.write_counts(batch, deltas)
+                except sqlite3.Error:
+                    self._requeue(batch)
+                    raise
+                self._flushed.update(batch)
+                logging.debug('meter flushed %d counters to %s' % (len(batch), self._store.path))
+            return len(batch)
+
+    def _requeue(self, keys):
+        for k in keys:
+            shard = self._shard(k)
+            with shard.lock:
+                shard.dirty.add(k)
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def usage(self, user, start, end, span='day'):
+        """
+        Time-bucketed usage for one user, including anything not yet flushed
+        :param user:
+        :param start: epoch seconds
+        :param end: epoch seconds
+        :param span: 'hour' or 'day'
+        :return: list of UsageBuckets
+        """
+        if self._store is None:
+            return []
+        self.flush()
+        return list(self._store.usage(user, start, end, span=span))
 
     def invoice_user(self, user):
-        for k, counter in self._counter.items():
-            if k[0] == user:
-                billing = self._billing[k]
-                u = UsageReport.from_counters(counter, billing)
-                billing.apply_query_counter(counter)
-                yield u
+        counts = self.snapshot(user=user)
+        reports = []
+        with self._billing_lock:
+            for k, usage in sorted(counts.items()):
+                billed = self._billing.get(k, [0, 0, 0])
+                counter = QueryCounter(user=k[0], origin=k[1], interface=k[2],
+                                       access=usage[_ACCESS], values=usage[_VALUES], update=usage[_UPDATE])
+                billing = BillingCounter(access=billed[_ACCESS], values=billed[_VALUES], update=billed[_UPDATE])
+                reports.append(UsageReport.from_counters(counter, billing))
+                self._billing[k] = list(usage)
+            if self._store is not None:
+                self.flush()
+                self._store.write_billed({k: self._billing[k] for k in counts})
+        for u in reports:
+            yield u
@@ -0,0 +1,150 @@
+"""
+Request metrics in the Prometheus text exposition format.
+
+Recording has to stay out of the way of the index routes, so every thread accumulates into its own plain dicts (no
+locks on the hot path); the accumulators are only merged when /metrics is scraped.  Latencies are tallied into a fixed
+set of histogram buckets per route template.
+"""
+
+import threading
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**kwargs):
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in kwargs.items())
+
+
+class _Accumulator(object):
+    __slots__ = ('requests', 'latency', 'errors')
+
+    def __init__(self):
+        self.requests = dict()  # (method, route, status) -> count
+        self.latency = dict()  # (method, route) -> [bucket counts..., +Inf count, sum]
+        self.errors = dict()  # (route, exception type) -> count
+
+
+class RequestMetrics(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()  # only taken when a thread makes its first observation, or on scrape
+
+    def _acc(self):
+        try:
+            return self._local.acc
+        except AttributeError:
+            acc = self._local.acc = _Accumulator()
+            with self._lock:
+                self._all.append(acc)
+            return acc
+
+    def observe(self, method, route, status, elapsed):
+        """
+        Record one request
+        :param method:
+        :param route: route template, e.g. '/{origin}/{process}/lci'
+        :param status: response status code
+        :param elapsed: seconds
+        :return:
+        """
+        acc = self._acc()
+        key = (method, route, status)
+        acc.requests[key] = acc.requests.get(key, 0) + 1
+        hist = acc.latency.get((method, route))
+        if hist is None:
+            hist = acc.latency[(method, route)] = [0] * (len(self._buckets) + 2)
+        for i, b in enumerate(self._buckets):
+            if elapsed <= b:
+                hist[i] += 1
+                break
+        else:
+            hist[-2] += 1
+        hist[-1] += elapsed
+
+    def error(self, route, exc_type):
+        acc = self._acc()
+        key = (route, exc_type)
+        acc.errors[key] = acc.errors.get(key, 0) + 1
+
+    def _merge(self):
+        requests, latency, errors = dict(), dict(), dict()
+        with self._lock:
+            accs = list(self._all)
+        for acc in accs:
+            for k, v in list(acc.requests.items()):
+                requests[k] = requests.get(k, 0) + v
+            for k, v in list(acc.latency.items()):
+                v = list(v)
+                if k in latency:
+                    latency[k] = [a + b for a, b in zip(latency[k], v)]
+                else:
+                    latency[k] = v
+            for k, v in list(acc.errors.items()):
+                errors[k] = errors.get(k, 0) + v
+        return requests, latency, errors
+
+    def render(self):
+        """
+        :return: list of exposition-format lines
+        """
+        requests, latency, errors = self._merge()
+        lines = ['# HELP xdb_requests_total Requests handled, by route template and status',
+                 '# TYPE xdb_requests_total counter']
+        for (method, route, status), v in sorted(requests.items()):
+            lines.append('xdb_requests_total%s %d' % (_labels(method=method, route=route, status=status), v))
+
+        lines += ['# HELP xdb_request_seconds Request latency, by route template',
+                  '# TYPE xdb_request_seconds histogram']
+        for (method, route), hist in sorted(latency.items()):
+            cum = 0
+            for b, n in zip(self._buckets + ('+Inf',), hist[:-1]):
+                cum += n
+                lines.append('xdb_request_seconds_bucket%s %d' % (_labels(method=method, route=route, le=b), cum))
+            lines.append('xdb_request_seconds_sum%s %.6f' % (_labels(method=method, route=route), hist[-1]))
+            lines.append('xdb_request_seconds_count%s %d' % (_labels(method=method, route=route), cum))
+
+        lines += ['# HELP xdb_errors_total Errors raised while handling requests, by exception type',
+                  '# TYPE xdb_errors_total counter']
+        for (route, exc_type), v in sorted(errors.items()):
+            lines.append('xdb_errors_total%s %d' % (_labels(route=route, type=exc_type), v))
+        return lines
+
+
+def render_meter(meter):
+    """
+    MeterReader totals, summed over users
+    :param meter:
+    :return: list of exposition-format lines
+    """
+    agg = dict()
+    for (user, origin, interface), counts in meter.snapshot().items():
+        tot = agg.setdefault((origin, interface), [0, 0, 0])
+        for i, n in enumerate(counts):
+            tot[i] += n
+    lines = ['# HELP xdb_meter_queries_total Metered queries, by origin and interface',
+             '# TYPE xdb_meter_queries_total counter']
+    for (origin, interface), tot in sorted(agg.items()):
+        for kind, n in zip(('access', 'values', 'update'), tot):
+            lines.append('xdb_meter_queries_total%s %d' % (_labels(origin=origin, interface=interface, kind=kind), n))
+    return lines
+
+
+def render_cache_stats(caches):
+    """
+    :param caches: dict of cache name -> dict as returned by LruCache.stats()
+    :return: list of exposition-format lines
+    """
+    lines = ['# HELP xdb_cache In-process cache sizes and hit / miss / eviction counts',
+             '# TYPE xdb_cache gauge']
+    for name, stats in sorted(caches.items()):
+        for k, v in sorted(stats.items()):
+            if isinstance(v, (int, float)):
+                lines.append('xdb_cache%s %d' % (_labels(cache=name, stat=k), v))
+    return lines
@@ -48,3 +48,17 @@ class BillingCounter(BaseModel):
 
 
             # keep a stack of these and increment them- UPON QUERY, not upon token validation
+
+
+class UsageBucket(BaseModel):
+    """
+    Usage accrued by one user on one origin:interface during one hour or one day, starting at 'start' (epoch seconds)
+    """
+    user: str
+    origin: str
+    interface: str
+    span: str
+    start: int
+    access: int = 0
+    values: int = 0
+    update: int = 0
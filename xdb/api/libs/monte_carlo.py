@@ -0,0 +1,173 @@
+"""
+Monte Carlo LCIA of a background node.
+
+The flat background stores deterministic values only, so the uncertainty is supplied by the client as geometric
+standard deviations: one applied to every background exchange value (A, B, Ad, Bf), one to every characterization
+factor.  Each value is multiplied by an independent lognormal factor with median 1, so the deterministic result is the
+median of each input.  The foreground block Af is held fixed.
+
+Samples are drawn in blocks.  For each block, the perturbed background systems (I - A_s) x_s = d_s are solved together
+by iterative refinement, preconditioned with the cached deterministic factorization of (I - A):
+    x <- x + (I - A)^-1 (d_s - (I - A_s) x)
+so that every iteration costs one multi-column triangular solve for the whole block, plus a sparse product per sample.
+Columns that fail to converge (large GSDs) are solved directly, as long as the time budget allows; a sample whose
+perturbed system turns out to be singular is dropped.  Sampling stops at the requested count or when the time budget
+runs out, whichever comes first.
+"""
+
+from scipy.sparse import eye
+from scipy.sparse.linalg import splu
+import numpy as np
+from time import perf_counter
+
+
+class MonteCarloLcia(object):
+    block_size = 32
+    tol = 1e-10
+    max_iter = 30
+
+    def __init__(self, solver, c, gsd_exchanges=1.0, gsd_factors=1.0, seed=None):
+        """
+
+        :param solver: the origin's BackgroundSolver
+        :param c: characterization matrix (mdim x k), see lcia_tables.characterization_matrix
+        :param gsd_exchanges: geometric standard deviation of background exchange values (1.0 = certain)
+        :param gsd_factors: geometric standard deviation of characterization factors (1.0 = certain)
+        :param seed: for reproducible samples
+        """
+        self.solver = solver
+        self.flat = solver.flat
+        self.c = c
+        self._sx = np.log(gsd_exchanges)
+        self._sc = np.log(gsd_factors)
+        self._rng = np.random.default_rng(seed)
+
+    def _perturb(self, m):
+        """
+        a copy of sparse matrix m with every stored value scaled by an independent lognormal factor
+        """
+        if self._sx <= 0 or not m.nnz:
+            return m
+        m = m.copy()
+        m.data = m.data * np.exp(self._rng.normal(0.0, self._sx, m.nnz))
+        return m
+
+    def deterministic(self, process, ref_flow):
+        flat = self.flat
+        xf, xd = self.solver.activity_levels(process, ref_flow)
+        lci = np.asarray(flat._bf.dot(xf)).reshape(flat.mdim)
+        if self.solver.complete:
+            lci = lci + np.asarray(flat._B.dot(xd)).reshape(flat.mdim)
+        return self.c.T.dot(lci)
+
+    def _solve_background(self, a_s, rhs, deadline):
+        """
+        solve (I - a_s[j]) x_j = rhs[:, j] for every column j
+        :param deadline: perf_counter() value after which no more columns are solved directly
+        :return: x, boolean array of the columns that were solved, whether the deadline cut any off
+        """
+        x = self.solver.solve_bg(rhs)
+        norms = np.maximum(np.abs(rhs).max(axis=0), 1e-300)
+        active = list(range(len(a_s)))
+        for _ in range(self.max_iter):
+            if not active:
+                break
+            r = np.zeros((rhs.shape[0], len(active)))
+            for n, j in enumerate(active):
+                r[:, n] = rhs[:, j] - x[:, j] + a_s[j].dot(x[:, j])
+            err = np.abs(r).max(axis=0) / norms[active]
+            if np.all(err <= self.tol):
+                active = []
+                break
+            dx = self.solver.solve_bg(r)
+            for n, j in enumerate(active):
+                x[:, j] += dx[:, n]
+            active = [j for n, j in enumerate(active) if not err[n] <= self.tol]  # nan means diverged
+        solved = np.ones(len(a_s), dtype=bool)
+        truncated = False
+        for j in active:  # did not converge from the deterministic start
+            if truncated or perf_counter() > deadline:
+                truncated = True
+                solved[j] = False
+                continue
+            try:
+                x[:, j] = splu((eye(a_s[j].shape[0]) - a_s[j]).tocsc()).solve(rhs[:, j])
+            except RuntimeError:  # singular
+                solved[j] = False
+        return x, solved, truncated
+
+    def _sample_block(self, xf, ed, b, deadline):
+        """
+        :return: array of scores for the samples that could be solved (up to b of them), whether the deadline cut any
+         off
+        """
+        flat = self.flat
+        k = self.c.shape[1]
+        bf_s = [self._perturb(flat._bf) for _ in range(b)]
+        lci = np.column_stack([bf.dot(xf) for bf in bf_s]) if flat.mdim else np.zeros((0, b))
+        solved = np.ones(b, dtype=bool)
+        truncated = False
+        if self.solver.complete:
+            a_s = [self._perturb(flat._A) for _ in range(b)]
+            rhs = np.column_stack([self._perturb(flat._ad).dot(xf) + ed for _ in range(b)])
+            xd, solved, truncated = self._solve_background(a_s, rhs, deadline)
+            for j in range(b):
+                if solved[j]:
+                    lci[:, j] += self._perturb(flat._B).dot(xd[:, j])
+            lci = lci[:, solved]
+        if self._sc > 0:
+            scores = np.empty((lci.shape[1], k))
+            for j in range(lci.shape[1]):
+                c_s = self.c * np.exp(self._rng.normal(0.0, self._sc, self.c.shape))
+                scores[j] = c_s.T.dot(lci[:, j])
+            return scores, truncated
+        return lci.T.dot(self.c), truncated
+
+    def run(self, process, ref_flow, samples, time_budget):
+        """
+        :param process: external ref
+        :param ref_flow: flow external ref
+        :param samples: number of samples wanted
+        :param time_budget: seconds
+        :return: samples x k array of scores, and whether sampling stopped early on the time budget
+        """
+        flat = self.flat
+        start = perf_counter()
+        deadline = start + time_budget
+        key = (process, ref_flow)
+        ed = np.zeros(flat.ndim)
+        if key in flat._bg_index:
+            xf = np.zeros(flat.pdim)
+            ed[flat._bg_index[key]] = 1.0
+        else:
+            ef = np.zeros(flat.pdim)
+            ef[flat._fg_index[key]] = 1.0
+            xf = self.solver.solve_fg(ef)
+
+        blocks = []
+        done = 0
+        truncated = False
+        while done < samples:
+            if perf_counter() > deadline:
+                truncated = True
+                break
+            b = min(self.block_size, samples - done)
+            scores, truncated = self._sample_block(xf, ed, b, deadline)
+            blocks.append(scores)
+            done += b
+            if truncated:
+                break
+        if blocks:
+            return np.vstack(blocks), truncated
+        return np.zeros((0, self.c.shape[1])), truncated
+
+
+def distribution(scores, percentiles):
+    """
+    :param scores: 1-d array of sampled scores
+    :param percentiles: list of percentiles, 0-100
+    :return: mean, std, list of percentile values -- or None, None, [] if there are no samples
+    """
+    if len(scores) == 0:
+        return None, None, []
+    return float(scores.mean()), float(scores.std()), [float(v) for v in np.percentile(scores, percentiles)]
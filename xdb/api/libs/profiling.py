@@ -0,0 +1,76 @@
+"""
+Admin-requested profiling of a single request.
+
+The middleware validates the request's profile command token and then installs a ProfileRequest in a context variable.
+TimedRoute's endpoint wrapper runs the endpoint (in its threadpool worker) under cProfile when one is installed.  The
+stats are dumped in pstats format to a file in the profile directory, and the file name is handed back so the
+middleware can report it in a response header.  Inspect with `python -m pstats <file>` or snakeviz.
+"""
+
+from contextvars import ContextVar
+from datetime import datetime
+import cProfile
+import pstats
+import io
+import logging
+import os
+import uuid
+
+
+_profile = ContextVar('xdb_profile_request', default=None)
+
+
+class ProfileRequest(object):
+    def __init__(self, profile_dir, label, summary=False):
+        """
+
+        :param profile_dir: where to write the .prof file
+        :param label: used in the file name, e.g. the endpoint name
+        :param summary: [False] also write a plain-text summary, sorted by cumulative time
+        """
+        self.profile_dir = profile_dir
+        self.label = label
+        self.summary = summary
+        self.filename = None
+
+    def run(self, func, *args, **kwargs):
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(func, *args, **kwargs)
+        finally:
+            self._save(prof, getattr(func, '__name__', 'endpoint'))
+
+    def _save(self, prof, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stem = '%s-%s-%s' % (datetime.now().strftime('%Y%m%dT%H%M%S'), name, uuid.uuid4().hex[:8])
+        path = os.path.join(self.profile_dir, stem + '.prof')
+        prof.dump_stats(path)
+        self.filename = os.path.basename(path)
+        if self.summary:
+            s = io.StringIO()
+            pstats.Stats(prof, stream=s).sort_stats('cumulative').print_stats(50)
+            with open(os.path.join(self.profile_dir, stem + '.txt'), 'w') as fp:
+                fp.write(s.getvalue())
+        logging.info('profile of %s written to %s' % (self.label, path))
+
+
+def start_profile(profile_dir, label, summary=False):
+    """
+    :return: ProfileRequest, token -- pass the token to stop_profile
+    """
+    req = ProfileRequest(profile_dir, label, summary=summary)
+    return req, _profile.set(req)
+
+
+def stop_profile(token):
+    _profile.reset(token)
+
+
+def call_endpoint(endpoint, *args, **kwargs):
+    """
+    Run an endpoint function, under the profiler if this request asked for one
+    """
+    req = _profile.get()
+    if req is None:
+        return endpoint(*args, **kwargs)
+    return req.run(endpoint, *args, **kwargs)
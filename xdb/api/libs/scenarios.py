@@ -0,0 +1,94 @@
+"""
+Parametric what-if LCIA of a background node.
+
+A node's LCIA score is linear in its direct exchanges: each dependency contributes its value times the unit score of
+the node it is terminated to (signed as sys_lci would sign it), and each emission or cutoff contributes its value times
+its characterization factor.  So for a set of scenarios that override some of those values, with
+    U: per-unit score of each direct exchange (exchanges x categories, from the LCIA tables)
+    V: exchange values in each scenario (scenarios x exchanges)
+all scenario scores are V U, one matrix product.  Unit scores come from the materialized LCIA tables, which are built
+in memory by one transposed solve against the cached factorization if they have not been built already.
+"""
+
+from .incremental import dependency_sign
+
+import numpy as np
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class ScenarioBatch(object):
+    def __init__(self, exchanges, unit):
+        """
+
+        :param exchanges: the node's direct exchanges (dependencies, emissions, cutoffs), in order
+        :param unit: (exchanges x k) per-unit scores
+        """
+        self.exchanges = exchanges
+        self.unit = unit
+        self.base = np.array([x.value for x in exchanges], dtype=float)
+
+    @classmethod
+    def from_node(cls, solver, tables, vectors, process, ref_flow):
+        """
+        :param solver: the origin's BackgroundSolver
+        :param tables: an LciaTable per category
+        :param vectors: a CharacterizationVector per category (same order)
+        :param process: ProcessRef, from a metered query
+        :param ref_flow: reference exchange
+        :return:
+        """
+        deps = list(process.dependencies(ref_flow=ref_flow))
+        exts = list(process.emissions(ref_flow=ref_flow)) + list(process.cutoffs(ref_flow=ref_flow))
+        unit = np.zeros((len(deps) + len(exts), len(vectors)))
+        for i, x in enumerate(deps):
+            sign = dependency_sign(solver.flat, x)
+            if sign is None:
+                raise ScenarioError('dependency %s/%s is not in the background' % (x.termination,
+                                                                                   x.flow.external_ref))
+            for k, table in enumerate(tables):
+                unit[i, k] = sign * table.score(x.termination, x.flow.external_ref)
+        for k, vec in enumerate(vectors):
+            cols = vec.columns(exts)  # before factors(): it may grow the vector
+            f = vec.factors()
+            for i, col in enumerate(cols):
+                if col is not None:
+                    unit[len(deps) + i, k] = f[col]
+        return cls(deps + exts, unit)
+
+    def _matches(self, override):
+        for i, x in enumerate(self.exchanges):
+            if x.flow.external_ref != override.flow:
+                continue
+            if override.direction is not None and x.direction != override.direction:
+                continue
+            if override.termination is not None and str(x.termination) != override.termination:
+                continue
+            yield i
+
+    def values(self, scenarios):
+        """
+        :param scenarios: list of objects with .overrides, each having flow, direction, termination, value
+        :return: (scenarios x exchanges) values, and a list of per-scenario error messages (None if ok)
+        """
+        v = np.tile(self.base, (len(scenarios), 1))
+        errors = []
+        for s, scenario in enumerate(scenarios):
+            err = None
+            for o in scenario.overrides:
+                hits = list(self._matches(o))
+                if not hits:
+                    err = 'override matches no exchange: %s %s %s' % (o.flow, o.direction or '', o.termination or '')
+                    break
+                for i in hits:
+                    v[s, i] = o.value
+            errors.append(err)
+        return v, errors
+
+    def scores(self, v):
+        """
+        :return: (scenarios x k) LCIA scores
+        """
+        return v.dot(self.unit)
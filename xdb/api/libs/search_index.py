@@ -0,0 +1,121 @@
+"""
+Token index for entity search.
+
+The index interface answers a search by testing every entity of the type against each keyword as a regex.  Token
+search is an alternative that clients ask for explicitly (tokens=true on the search routes): when an origin is loaded,
+tokenize each entity's searchable properties into an inverted index (etype, property, token) -> entity positions, and
+answer a query by intersecting postings.
+
+The matching is not the same as the regex's, which is why it is opt-in.  A plain query is one or more words (letters,
+digits, spaces, hyphens and commas), and every word must match the start of some token in the property-- so
+name='steel hot' finds 'Steel, hot rolled', and name='electr' finds 'electricity' but not 'hydroelectricity'.  Anything
+else (regex syntax, or a property we don't index) is tested by regex, as before: on the index's candidates if some
+other keyword could use the index, otherwise by the usual full scan.
+"""
+
+from antelope import IndexRequired
+
+from bisect import bisect_left
+import re
+
+
+SEARCH_FIELDS = {
+    'processes': ('name', 'classifications', 'spatialscope', 'comment'),
+    'flows': ('name', 'casnumber', 'classifications', 'comment'),
+    'quantities': ('name', 'referenceunit', 'comment'),
+}
+
+_TOKEN = re.compile(r'\w+')
+_PLAIN = re.compile(r'^[\w\s,\-]+$')
+
+
+def _expand(tag):
+    """
+    property value as text, the same way the archive's regex search sees it
+    """
+    if tag is None:
+        return ''
+    elif isinstance(tag, str):
+        return tag
+    return '\n'.join([_expand(t) for t in tag])
+
+
+def query_terms(value):
+    """
+    :param value: a search keyword's value
+    :return: the lowercase words of a plain query, or None if the value has to be treated as a regex
+    """
+    if not isinstance(value, str) or not _PLAIN.match(value):
+        return None
+    return _TOKEN.findall(value.lower()) or None
+
+
+def regex_match(entity, k, v):
+    return entity.has_property(k) and bool(re.search(v, _expand(entity[k]), flags=(re.IGNORECASE | re.MULTILINE)))
+
+
+class SearchIndex(object):
+    def __init__(self, query):
+        """
+
+        :param query: an unmetered query for the origin
+        """
+        self.origin = query.origin
+        self._entities = dict()  # etype -> list of entity refs, in the index interface's order
+        self._postings = dict()  # (etype, field) -> {token: [positions]}
+        self._tokens = dict()  # (etype, field) -> sorted tokens, for prefix lookups
+        for etype, fields in SEARCH_FIELDS.items():
+            try:
+                ents = list(getattr(query, etype)())
+            except IndexRequired:
+                continue
+            self._entities[etype] = ents
+            for field in fields:
+                postings = dict()
+                for i, e in enumerate(ents):
+                    if not e.has_property(field):
+                        continue
+                    for t in set(_TOKEN.findall(_expand(e[field]).lower())):
+                        postings.setdefault(t, []).append(i)
+                self._postings[etype, field] = postings
+                self._tokens[etype, field] = sorted(postings)
+
+    def __len__(self):
+        return sum(len(v) for v in self._entities.values())
+
+    def indexed(self, etype):
+        return etype in self._entities
+
+    def _match(self, etype, field, term):
+        """
+        positions of entities with a token in the field that starts with term
+        """
+        postings = self._postings[etype, field]
+        tokens = self._tokens[etype, field]
+        found = set()
+        i = bisect_left(tokens, term)
+        while i < len(tokens) and tokens[i].startswith(term):
+            found.update(postings[tokens[i]])
+            i += 1
+        return found
+
+    def search(self, etype, **kwargs):
+        """
+        :param etype: one of SEARCH_FIELDS
+        :param kwargs: property -> query, as for the index interface
+        :return: generator of matching entity refs in index order, or None if no keyword can use the index
+        """
+        hits = None
+        rest = dict()
+        for k, v in kwargs.items():
+            terms = query_terms(v)
+            if terms is None or (etype, k) not in self._postings:
+                rest[k] = v
+                continue
+            for t in terms:
+                found = self._match(etype, k, t)
+                hits = found if hits is None else hits & found
+        if hits is None:
+            return None
+        ents = self._entities[etype]
+        return (ents[i] for i in sorted(hits) if all(regex_match(ents[i], k, v) for k, v in rest.items()))
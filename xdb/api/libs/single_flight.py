@@ -0,0 +1,64 @@
+"""
+Coalescing of identical concurrent computations.
+
+When several threadpool workers ask for the same heavy result at once (e.g. a dashboard fanning out the same LCIA to
+many clients), only the first one computes it; the rest block until it is done and share the result.  Nothing is
+retained once the computation finishes-- that is the job of the caches.  Callers remain responsible for their own
+authorization and serialization; the second element of the return value tells a caller whether it was a follower.
+"""
+
+import threading
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        :param key: hashable identity of the computation
+        :param fn:
+        :return: result, shared -- shared is True if the result was computed by another caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        return {'size': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers}
@@ -0,0 +1,116 @@
+"""
+Opt-in per-request phase timing, reported as a Server-Timing header.
+
+The middleware installs a PhaseTimer in a context variable; the context is copied into the threadpool worker that runs
+the endpoint, so code anywhere in the request can wrap a stretch of work in `timed('phase')`.  When no timer is
+installed, `timed` costs one context variable lookup.
+
+Phases we report:
+ - auth: verifying the token and constructing grants
+ - query: obtaining authorized queries
+ - compute: catalog and background computation (lci, sys_lci, do_lcia, ...)
+ - serialize: building pydantic response models, plus FastAPI's validation and encoding of the endpoint's return value
+
+TimedRoute is what measures the last part: it wraps each endpoint so the moment the endpoint returns is known.  The
+same wrapper is where an admin-requested profile of the endpoint is taken (see profiling.py).
+"""
+
+from fastapi.routing import APIRoute
+
+from .profiling import call_endpoint
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+import functools
+
+
+_timer = ContextVar('xdb_phase_timer', default=None)
+
+
+class PhaseTimer(object):
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases = dict()  # name -> seconds; insertion order is report order
+        self.returned = None  # when the endpoint function returned
+
+    def add(self, phase, elapsed):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def header(self):
+        """
+        :return: a Server-Timing header value, durations in ms
+        """
+        items = ['%s;dur=%.2f' % (k, v * 1000) for k, v in self.phases.items()]
+        items.append('total;dur=%.2f' % (self.elapsed() * 1000))
+        return ', '.join(items)
+
+    def serialize(self):
+        d = {k: round(v * 1000, 3) for k, v in self.phases.items()}
+        d['total'] = round(self.elapsed() * 1000, 3)
+        return d
+
+
+def start_timer():
+    """
+    :return: timer, token -- pass the token to stop_timer
+    """
+    timer = PhaseTimer()
+    return timer, _timer.set(timer)
+
+
+def stop_timer(token):
+    _timer.reset(token)
+
+
+def current_timer():
+    return _timer.get()
+
+
+@contextmanager
+def timed(phase):
+    timer = _timer.get()
+    if timer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, perf_counter() - start)
+
+
+def _mark_return(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            return call_endpoint(endpoint, *args, **kwargs)
+        finally:
+            timer = _timer.get()
+            if timer is not None:
+                timer.returned = perf_counter()
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    Attributes the time between the endpoint returning and the response being ready to the 'serialize' phase.
+    Endpoints must be sync functions (as they all are here).
+    """
+    def __init__(self, path, endpoint, **kwargs):
+        super(TimedRoute, self).__init__(path, _mark_return(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super(TimedRoute, self).get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timer = _timer.get()
+            if timer is not None and timer.returned is not None:
+                timer.add('serialize', perf_counter() - timer.returned)
+            return response
+
+        return timed_handler
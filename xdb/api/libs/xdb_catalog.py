@@ -2,23 +2,69 @@
 An LcCatalog subclass that yields XdbQueries
 """
 
+from antelope import ConversionReferenceMismatch, NoFactorsFound, EntityNotFound
 from antelope.xdb_tokens import IssuerKey
 from antelope_core import LcCatalog
+from antelope_core.catalog_query import CatalogQuery
+from antelope_core.entities import MetaQuantityUnit
 from .xdb_query import XdbQuery
 from .meter_reader import MeterReader
+from .grant_cache import GrantCache
+from .lru_cache import LruCache
+from .single_flight import SingleFlight
+from .lcia_vectors import CharacterizationVector
+from .lcia_tables import LciaTable, TABLES_DIR, table_filename, build_lcia_tables, save_lcia_table
+from .background_solver import BackgroundSolver, flat_background
+from .cf_index import CfIndex
+from .search_index import SearchIndex
 
 import os
 import json
+import shutil
+import hashlib
 import requests
 import datetime
 
 
 PUBKEYS_FILENAME = 'PUBKEYS.json'
+_NO_FACTORS = 'no factors'  # negative entry in the quantity-relation cache
+METER_FILENAME = 'meter.sqlite'
+
+
+def _grant_fingerprint(origin, grants):
+    """
+    Canonical digest of the grants that apply to a given origin-- built from the same {access: grant} map that
+    XdbQuery retains (the last applicable grant per access type), so that equal digests mean equal behavior
+    :param origin:
+    :param grants:
+    :return:
+    """
+    kept = {g.access: g for g in grants if origin.startswith(g.origin)}
+    spec = sorted((g.user, g.origin, g.issuer or '', g.access, g.values, g.update) for g in kept.values())
+    return hashlib.sha256(repr(spec).encode()).digest()
+
+
+def _related_origins(org, origin):
+    return org.startswith(origin) or origin.startswith(org)
 
 
 class XdbCatalog(LcCatalog):
 
     pubkeys = None
+    grant_cache_size = 4096
+    query_pool_size = 256
+    lci_cache_size = 2000000  # total exchanges held across cached background results
+    meter_flush_interval = 30.0
+    char_vector_cache_size = 1000000  # flows classified across all (quantity, locale, dist) characterization memos
+    lcia_table_cache_size = 256  # (origin, quantity) materialized LCIA tables held in memory
+    qr_cache_size = 200000  # quantity_relation results, including misses
+    cf_index_cache_size = 512  # per-quantity CF hash indexes
+    transient_flow_cache_size = 20000  # flows resolved from clients' posted flow specs
+    canonical_cache_size = 4096  # (origin, quantity) -> canonical quantity and its categories
+
+    @property
+    def meter_file(self):
+        return os.path.join(self._rootdir, METER_FILENAME)
 
     @property
     def pubkeys_file(self):
@@ -63,17 +109,295 @@ class XdbCatalog(LcCatalog):
             j['expiry'] = datetime.datetime.fromisoformat(j['expiry']).timestamp()
         master_issuer = IssuerKey(**j)
         print('Storing key for master issuer %s' % master_issuer.issuer)
-        self.pubkeys[master_issuer.issuer] = master_issuer
+        self.set_issuer_key(master_issuer)
         self.save_pubkeys()
 
+    def set_issuer_key(self, issuer_key):
+        """
+        Install or replace an issuer's public key.  Any cached grants verified with the prior key are dropped.
+        :param issuer_key:
+        :return:
+        """
+        self.pubkeys[issuer_key.issuer] = issuer_key
+        self.grant_cache.invalidate_issuer(issuer_key.issuer)
+
+    def authorized_query(self, origin, grants):
+        """
+        Return an XdbQuery for the origin that enforces (and meters) the supplied grants.  The data are static, so
+        queries are pooled by origin and grant fingerprint rather than rebuilt on every request.  Since the
+        fingerprint includes the grants' user, metering still lands on the right user's counters.
+        :param origin:
+        :param grants:
+        :return:
+        """
+        key = (origin, _grant_fingerprint(origin, grants))
+        q = self._query_pool.get(key)
+        if q is None:
+            q = self.query(origin, grants=grants, cache=False)
+            self._query_pool.put(key, q)
+        return q
+
+    def invalidate_origin(self, origin):
+        """
+        Discard pooled queries and cached background results that could resolve to the named origin, e.g. after its resources are reloaded
+        :param origin:
+        :return:
+        """
+        self._query_pool.discard_if(lambda k, v: _related_origins(k[0], origin))
+        self.lci_cache.discard_if(lambda k, v: _related_origins(k[0], origin))
+        self.char_vectors.clear()  # memos span flow origins; reloads are rare enough to start over
+        self.qr_cache.clear()  # likewise
+        self.cf_indexes.clear()  # a reload can bring in new factors for any quantity
+        self.transient_flows.clear()  # these hold canonical quantities and qdb entities
+        self.canonical_quantities.clear()  # a reload can change what a quantity ref resolves to
+        self.lcia_tables.discard_if(lambda k, v: _related_origins(k[0], origin))
+        for org in [k for k in self._solvers if _related_origins(k, origin)]:
+            self._solvers.pop(org, None)
+        for org in [k for k in self._search_indexes if _related_origins(k, origin)]:
+            self._search_indexes.pop(org, None)
+
+    def characterization_vector(self, quantity, locale='GLO', dist=2):
+        """
+        The shared memo of LCIA classifications for a canonical quantity
+        :param quantity:
+        :param locale:
+        :param dist:
+        :return: CharacterizationVector
+        """
+        key = (quantity.origin, quantity.external_ref, locale, dist)
+        vec = self.char_vectors.get(key)
+        if vec is None:
+            vec, _ = self.inflight.do(('char_vector',) + key, self._new_char_vector, key, quantity, locale, dist)
+        else:
+            self.char_vectors.reweigh(key)  # vectors grow as they see new flows; the weight lags by one use
+        return vec
+
+    def _new_char_vector(self, key, quantity, locale, dist):
+        vec = self.char_vectors.get(key)
+        if vec is None:
+            # the quantity implementation's do_lcia works with the canonical entity; so do we
+            vec = CharacterizationVector(self.lcia_engine.get_canonical(quantity), locale=locale, dist=dist)
+            self.char_vectors.put(key, vec)
+        return vec
+
+    def background_solver(self, origin):
+        """
+        The origin's flat background with its cached factorizations, shared across requests
+        :param origin:
+        :return: BackgroundSolver, or None if the origin has no flat background
+        """
+        solver = self._solvers.get(origin)
+        if solver is None:
+            impl, flat = flat_background(CatalogQuery(origin, self))
+            if flat is None:
+                solver = self._solvers.setdefault(origin, False)  # remembered until the origin is invalidated
+            else:
+                solver = self._solvers.setdefault(origin, BackgroundSolver(impl, flat))
+        return solver or None
+
+    def search_index(self, origin):
+        """
+        The origin's entity search index, built on first use (or when the origin is loaded)
+        :param origin:
+        :return: SearchIndex
+        """
+        index = self._search_indexes.get(origin)
+        if index is None:
+            index, _ = self.inflight.do(('search_index', origin), self._new_search_index, origin)
+        return index
+
+    def _new_search_index(self, origin):
+        index = self._search_indexes.get(origin)
+        if index is None:
+            index = self._search_indexes.setdefault(origin, SearchIndex(CatalogQuery(origin, self)))
+        return index
+
+    def lcia_table(self, origin, quantity):
+        """
+        The materialized LCIA table for the origin's background and the given quantity, if one has been built
+        :param origin:
+        :param quantity: canonical quantity
+        :return: LciaTable or None
+        """
+        key = (origin, quantity.origin, quantity.external_ref)
+        table = self.lcia_tables.get(key)
+        if table is None:
+            solver = self.background_solver(origin)
+            if solver is None:
+                table = False
+            else:
+                table = LciaTable.load(table_filename(self._rootdir, origin, quantity), quantity, solver.flat,
+                                       solver.fingerprint) or False
+            self.lcia_tables.put(key, table)  # remember misses too; a build replaces them
+        return table or None
+
+    def build_lcia_tables(self, origin, quantities, locale='GLO', dist=2, save=True):
+        """
+        Compute and store unit scores of every background process in the origin, for each of the quantities
+        :param origin:
+        :param quantities: canonical quantities (not methods-- expand categories first)
+        :param locale:
+        :param dist:
+        :param save: [True] write the tables to disk; otherwise they are only held in memory
+        :return: number of (process, ref_flow) nodes scored
+        """
+        solver = self.background_solver(origin)
+        if solver is None:
+            raise ValueError('%s has no flat background' % origin)
+        flat = solver.flat
+        vectors = [self.characterization_vector(q, locale=locale, dist=dist) for q in quantities]
+        fg, bg = build_lcia_tables(solver, vectors)
+        for k, q in enumerate(quantities):
+            if save:
+                save_lcia_table(table_filename(self._rootdir, origin, q), solver.fingerprint, fg[:, k], bg[:, k])
+            self.lcia_tables.put((origin, q.origin, q.external_ref),
+                                 LciaTable(q, fg[:, k], bg[:, k], flat._fg_index, flat._bg_index))
+        return flat.pdim + flat.ndim
+
+    def unit_scores(self, origin, quantities):
+        """
+        LCIA tables for each quantity, computing (in one batch, in memory) any that have not been built
+        :param origin:
+        :param quantities: canonical quantities
+        :return: list of LciaTables
+        """
+        missing = [q for q in quantities if self.lcia_table(origin, q) is None]
+        if missing:
+            self.inflight.do(('unit_scores', origin) + tuple((q.origin, q.external_ref) for q in missing),
+                             self.build_lcia_tables, origin, missing, save=False)
+        return [self.lcia_table(origin, q) for q in quantities]
+
+    def drop_lcia_tables(self, origin):
+        shutil.rmtree(os.path.join(self._rootdir, TABLES_DIR, origin), ignore_errors=True)
+        self.lcia_tables.discard_if(lambda k, v: k[0] == origin)
+
+    def canonical_quantity(self, origin, quantity):
+        """
+        Resolve a quantity ref to its canonical quantity and categories, once per (origin, quantity).  Failed
+        lookups raise as usual and are not remembered.
+        :param origin: [None] if given, the quantity is first retrieved from the origin, which registers it with the qdb
+        :param quantity: external ref or synonym
+        :return: canonical quantity, tuple of its categories (see quantity_categories)
+        """
+        key = (origin, quantity)
+        found = self.canonical_quantities.get(key)
+        if found is None:
+            if origin is not None:
+                self.query(origin).get(quantity)  # registers it with qdb
+            qq = self.lcia_engine.get_canonical(quantity)
+            found = (qq, self.quantity_categories(qq))
+            self.canonical_quantities.put(key, found)
+        return found
+
+    def quantity_categories(self, qq):
+        """
+        :param qq: canonical quantity
+        :return: tuple of the canonical impactCategories if qq is an LCIA method, else (qq,)
+        """
+        key = ('categories', qq.origin, qq.external_ref)
+        qs = self.canonical_quantities.get(key)
+        if qs is None:
+            if qq.unit == MetaQuantityUnit.unitstring and qq.has_property('impactCategories'):
+                qs = tuple(self._canonical_category(qq.origin, k) for k in qq['impactCategories'])
+            else:
+                qs = (qq,)
+            self.canonical_quantities.put(key, qs)
+        return qs
+
+    def _canonical_category(self, origin, k):
+        try:
+            return self.lcia_engine.get_canonical(k)
+        except EntityNotFound:
+            self.query(origin).get(k)  # registers it with qdb
+            return self.lcia_engine.get_canonical(k)
+
+    def cf_index(self, quantity):
+        """
+        The hash index of a canonical LCIA quantity's factors, built on first use
+        :param quantity: canonical quantity
+        :return: CfIndex, or None if the quantity is not an LCIA category (those are unit conversions)
+        """
+        if not quantity.is_lcia_method:
+            return None
+        key = (quantity.origin, quantity.external_ref)
+        index = self.cf_indexes.get(key)
+        if index is None:
+            index, _ = self.inflight.do(('cf_index',) + key, self._new_cf_index, key, quantity)
+        return index
+
+    def _new_cf_index(self, key, quantity):
+        index = self.cf_indexes.get(key)
+        if index is None:
+            index = CfIndex(self.lcia_engine, quantity)
+            self.cf_indexes.put(key, index)
+        return index
+
+    def quantity_relation(self, quantity, flowable, ref_quantity, context, locale):
+        """
+        Memoized quantity.quantity_relation, for factor lookups that come from clients' flow specs.  Exact matches are
+        answered from the quantity's CF index; the rest are memoized, misses (NoFactorsFound,
+        ConversionReferenceMismatch) included.
+        :param quantity: canonical quantity
+        :param flowable:
+        :param ref_quantity:
+        :param context: tuple
+        :param locale:
+        :return: QR result, or None if there is no factor
+        """
+        index = self.cf_index(quantity)
+        if index is not None:
+            qr = index.lookup(flowable, ref_quantity, context, locale)
+            if qr is not None:
+                return qr
+        key = (quantity.origin, quantity.external_ref, flowable, ref_quantity, context, locale)
+        qr = self.qr_cache.get(key)
+        if qr is None:
+            try:
+                qr = quantity.quantity_relation(flowable, ref_quantity, context, locale)
+            except (ConversionReferenceMismatch, NoFactorsFound):
+                qr = _NO_FACTORS
+            self.qr_cache.put(key, qr)
+        if qr is _NO_FACTORS:
+            return None
+        return qr
+
+    def cache_stats(self):
+        """
+        :return: dict of cache name -> LruCache stats
+        """
+        return {'grants': self.grant_cache.stats(),
+                'queries': self._query_pool.stats(),
+                'lci': self.lci_cache.stats(),
+                'char_vectors': self.char_vectors.stats(),
+                'lcia_tables': self.lcia_tables.stats(),
+                'qr': self.qr_cache.stats(),
+                'cf_index': self.cf_indexes.stats(),
+                'transient_flows': self.transient_flows.stats(),
+                'canonical': self.canonical_quantities.stats(),
+                'inflight': self.inflight.stats()}
+
     def reset_origin(self, origin):
         for res in self.resources(origin):
             self.delete_resource(res)
         self._queries.pop(origin, None)
+        self.drop_lcia_tables(origin)
+        self.invalidate_origin(origin)
 
     def __init__(self, *args, **kwargs):
         super(XdbCatalog, self).__init__(*args, **kwargs)
-        self.meter = MeterReader()
+        self.meter = MeterReader(self.meter_file, flush_interval=self.meter_flush_interval)
+        self.grant_cache = GrantCache(self.grant_cache_size)
+        self._query_pool = LruCache(self.query_pool_size)
+        self.lci_cache = LruCache(self.lci_cache_size, weigh=lambda v: len(v) + 1)
+        self.inflight = SingleFlight()
+        self.char_vectors = LruCache(self.char_vector_cache_size, weigh=lambda v: len(v) + 1)
+        self.lcia_tables = LruCache(self.lcia_table_cache_size)
+        self.qr_cache = LruCache(self.qr_cache_size)
+        self.cf_indexes = LruCache(self.cf_index_cache_size)
+        self.transient_flows = LruCache(self.transient_flow_cache_size)  # flow spec -> flow, never registered
+        self.canonical_quantities = LruCache(self.canonical_cache_size)
+        self._solvers = dict()  # origin -> BackgroundSolver, or False if the origin has none
+        self._search_indexes = dict()  # origin -> SearchIndex
         self.load_pubkeys()
 
     _query_type = XdbQuery
@@ -2,16 +2,48 @@
 A CatalogQuery subclass that enforces access limitations
 """
 
+from antelope import ExchangeRef
 from antelope_core.catalog_query import CatalogQuery, BackgroundSetup
 from antelope.interfaces.iexchange import EXCHANGE_VALUES_REQUIRED
 from antelope.interfaces.ibackground import BACKGROUND_VALUES_REQUIRED
 
+from .incremental import incremental_unobserved_lci
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 
 _VALUES_REQUIRED = EXCHANGE_VALUES_REQUIRED.union(BACKGROUND_VALUES_REQUIRED)
 _NOAUTH_IFACES = ('basic', 'index')
 
 _AUTH_NOT_REQUIRED = {'is_lcia_engine', 'check_bg'}
 
+# background results that depend only on (origin, process, ref_flow), and are static, so they can be shared across
+# requests via the catalog's lci_cache
+_CACHED_BG_QUERIES = {'lci', 'ad', 'bf', 'dependencies', 'emissions', 'cutoffs'}
+
+
+def observed_key(observed):
+    """
+    Canonical form of a set of observed flows: ProcessRef.unobserved_lci filters on (flow.external_ref, direction)
+    """
+    return tuple(sorted(set((k.flow.external_ref, k.direction) for k in observed)))
+
+
+_unmetered = ContextVar('xdb_unmetered', default=False)
+
+
+@contextmanager
+def unmetered():
+    """
+    Authorization is still enforced, but nothing is metered-- for work that was metered when it was submitted (jobs)
+    """
+    token = _unmetered.set(True)
+    try:
+        yield
+    finally:
+        _unmetered.reset(token)
+
 
 class InterfaceNotAuthorized(Exception):
     pass
@@ -37,18 +69,155 @@ class XdbQuery(CatalogQuery):
         except AttributeError:
             raise BackgroundSetup('Failed to configure background')
 
+    def authorize(self, itype, attrname):
+        """
+        Check that the query's grants permit attrname on itype, and meter it.  Anything that answers a query without
+        going through _perform_query (e.g. from a cache) must still call this.
+        :param itype:
+        :param attrname:
+        :return:
+        """
+        if attrname in _AUTH_NOT_REQUIRED:
+            return
+        if itype in self._grants:
+            grant = self._grants[itype]
+            if _unmetered.get():
+                return
+            if attrname in _VALUES_REQUIRED:
+                self._catalog.meter.values(grant)
+            else:
+                self._catalog.meter.access(grant)
+
+        else:
+            if itype not in _NOAUTH_IFACES:
+                raise InterfaceNotAuthorized(self.origin, itype)
+            # otherwise pass
+
+    @staticmethod
+    def _bg_cache_key(origin, attrname, args, kwargs):
+        """
+        (origin, process, ref_flow, attrname) if the query is one whose result we cache, else None
+        """
+        if attrname not in _CACHED_BG_QUERIES:
+            return None
+        kws = dict(kwargs)
+        ref_flow = kws.pop('ref_flow', None)
+        if len(args) == 2:
+            process, ref_flow = args
+        elif len(args) == 1:
+            process = args[0]
+        else:
+            return None
+        if kws or not isinstance(process, str) or not (ref_flow is None or isinstance(ref_flow, str)):
+            return None
+        return origin, process, ref_flow, attrname
+
+    @staticmethod
+    def _sys_lci_key(origin, attrname, args, kwargs):
+        """
+        identity of a sys_lci query, if its demand is a concrete list of models (as POSTed); else None
+        """
+        if attrname != 'sys_lci' or kwargs or len(args) != 1 or not isinstance(args[0], (list, tuple)):
+            return None
+        try:
+            return origin, 'sys_lci', tuple(x.json() for x in args[0])
+        except AttributeError:
+            return None
+
     def _perform_query(self, itype, attrname, exc, *args, **kwargs):
-        if attrname not in _AUTH_NOT_REQUIRED:
-            if itype in self._grants:
-                grant = self._grants[itype]
-                if attrname in _VALUES_REQUIRED:
-                    self._catalog.meter.values(grant)
-                else:
-                    self._catalog.meter.access(grant)
+        self.authorize(itype, attrname)
 
-            else:
-                if itype not in _NOAUTH_IFACES:
-                    raise InterfaceNotAuthorized(self.origin, itype)
-                # otherwise pass
+        key = self._bg_cache_key(self.origin, attrname, args, kwargs)
+        if key is not None:
+            cache = self._catalog.lci_cache
+            result = cache.get(key)
+            if result is None:
+                def _compute():
+                    _r = list(super(XdbQuery, self)._perform_query(itype, attrname, exc, *args, **kwargs))
+                    cache.put(key, _r)
+                    return _r
+                result, _ = self._catalog.inflight.do(key, _compute)
+            return iter(result)
+
+        key = self._sys_lci_key(self.origin, attrname, args, kwargs)
+        if key is not None:
+            def _sys_lci():
+                _r = list(super(XdbQuery, self)._perform_query(itype, attrname, exc, *args, **kwargs))
+                if not _r:
+                    return None, []
+                _p = _r[0].process  # the implementation reports every exchange on the same node
+                return (_p.origin, _p.external_ref), [(x.flow.origin, x.flow.external_ref, x.direction, x.value,
+                                                        x.termination) for x in _r]
+            (node, raw), _ = self._catalog.inflight.do(key, _sys_lci)
+            if node is None:
+                return iter([])
+            with unmetered():
+                process = self._grounded_query(node[0]).get(node[1])
+            return iter(self._exchange_refs(process, raw))
 
         return super(XdbQuery, self)._perform_query(itype, attrname, exc, *args, **kwargs)
+
+    def check_authorized(self, itype):
+        """
+        Raise InterfaceNotAuthorized unless the grants permit itype.  Nothing is metered.
+        :param itype:
+        :return:
+        """
+        if itype not in self._grants and itype not in _NOAUTH_IFACES:
+            raise InterfaceNotAuthorized(self.origin, itype)
+
+    def unobserved_lci(self, process, observed, ref_flow=None, incremental=False):
+        """
+        Coalesced ProcessRef.unobserved_lci.  Every caller is checked for the background interface before anything is
+        computed.  The computation itself runs unmetered, and only its raw values are shared: each caller gets
+        exchanges built on its own process, and is metered for the background queries the computation actually made.
+        :param process: a ProcessRef obtained from this query
+        :param observed: iterable of DirectedFlows
+        :param ref_flow: a reference exchange or flow ref
+        :param incremental: [False] derive the result from the node's cached LCI less the cached LCIs of its observed
+         dependencies, where the origin's background allows it (see incremental.py)
+        :return: list of exchanges
+        """
+        self.check_authorized('background')
+        obs = observed_key(observed)
+        rf = getattr(ref_flow, 'flow', ref_flow)
+        rf = getattr(rf, 'external_ref', rf)
+        key = (self.origin, process.external_ref, rf, 'unobserved_lci', obs, bool(incremental))
+
+        def _compute():
+            calls = []
+            with unmetered():
+                lci = None
+                if incremental and obs:
+                    solver = self._catalog.background_solver(self.origin)
+                    if solver is not None:
+                        lci = incremental_unobserved_lci(self, solver.flat, process, set(obs), ref_flow, calls=calls)
+                if lci is None:
+                    lci = process.unobserved_lci(observed, ref_flow=ref_flow)
+                    if obs:
+                        calls.extend(('dependencies', 'emissions', 'cutoffs', 'sys_lci'))
+                    else:
+                        calls.append('lci')
+                return [(x.flow.origin, x.flow.external_ref, x.direction, x.value, x.termination) for x in lci], calls
+
+        (raw, calls), _ = self._catalog.inflight.do(key, _compute)
+        for attrname in calls:
+            self.authorize('background', attrname)
+        return self._exchange_refs(process, raw)
+
+    def _exchange_refs(self, process, raw):
+        """
+        ExchangeRefs on the caller's own process, with flow refs from the caller's own queries
+        :param process:
+        :param raw: list of (flow origin, flow external ref, direction, value, termination)
+        :return:
+        """
+        flows = dict()
+        result = []
+        with unmetered():  # entity lookups are not part of the metered computation
+            for org, ref, dirn, value, term in raw:
+                flow = flows.get((org, ref))
+                if flow is None:
+                    flow = flows[org, ref] = self._grounded_query(org).get(ref)
+                result.append(ExchangeRef(process, flow, dirn, value=value, termination=term))
+        return result
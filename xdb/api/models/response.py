@@ -2,8 +2,8 @@
 Non-server-specific models now live in the antelope interface
 """
 from pydantic import BaseModel
-from typing import List
-from antelope.models import QuantityConversion
+from typing import List, Optional, Dict, Union
+from antelope.models import QuantityConversion, DetailedLciaResult, SummaryLciaResult
 import pkg_resources
 
 try:
@@ -33,11 +33,15 @@ class ServerMeta(BaseModel):
 class QdbMeta(BaseModel):
     title: str
     description: str
+    qr_cache: Optional[Dict[str, float]] = None
 
     @classmethod
     def from_cat(cls, cat):
         lcia = cat.lcia_engine
-        return cls(title=lcia.__class__.__name__, description="Antelope LCIA implementation")
+        stats = cat.qr_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return cls(title=lcia.__class__.__name__, description="Antelope LCIA implementation", qr_cache=stats)
 
 
 class PostTerm(BaseModel):
@@ -59,3 +63,149 @@ class PostFactors(BaseModel):
 
     def add_qr_result(self, qrr):
         self.factors.append(QuantityConversion.from_qrresult(qrr))
+
+
+class BatchLciaNode(BaseModel):
+    process: str
+    ref_flow: Optional[str] = None
+
+
+class BatchLciaRequest(BaseModel):
+    """
+    Score every node against every quantity.  quantities may include LCIA methods, which are expanded into their
+    impactCategories.  If qty_org is omitted, quantities are resolved through the catalog's LCIA engine.
+    """
+    nodes: List[BatchLciaNode]
+    quantities: List[str]
+    qty_org: Optional[str] = None
+
+
+class BatchLciaRow(BaseModel):
+    """
+    One row of the batch results matrix: a node's results in the order the quantities were given.  A node that could
+    not be found or resolved to a reference reports an error and no results; the rest of the batch proceeds.
+    Results are detailed if the caller has an exchange grant for the origin, else summaries.
+    """
+    process: str
+    ref_flow: Optional[str]
+    results: List[Union[DetailedLciaResult, SummaryLciaResult]] = []
+    error: Optional[str] = None
+
+
+class LciaContribution(BaseModel):
+    """
+    One contributor to an LCIA score: a background process (with its reference flow) or an exterior flow (with its
+    direction and context)
+    """
+    entity_id: str
+    name: Optional[str] = None
+    ref_flow: Optional[str] = None
+    direction: Optional[str] = None
+    context: Optional[List[str]] = None
+    result: float
+
+
+class LciaContributionResult(BaseModel):
+    """
+    A node's LCIA score for one quantity, split by contributing process or flow.  Only the largest contributions are
+    listed; the rest are summed into remainder, so that total = sum(contributions) + remainder.
+    """
+    origin: str
+    process: str
+    ref_flow: str
+    quantity: str
+    by: str
+    total: float
+    remainder: float
+    contributions: List[LciaContribution] = []
+
+
+class MonteCarloRequest(BaseModel):
+    """
+    Uncertainty to apply, as geometric standard deviations of lognormal factors with median 1.  The flat background
+    does not carry uncertainty data of its own.
+    """
+    samples: int = 500
+    gsd_exchanges: float = 1.0
+    gsd_factors: float = 1.0
+    percentiles: List[float] = [2.5, 50.0, 97.5]
+    seed: Optional[int] = None
+    time_budget: Optional[float] = None
+
+
+class MonteCarloResult(BaseModel):
+    """
+    Distribution of a node's LCIA score for one quantity.  samples may be fewer than requested if the time budget ran
+    out, in which case truncated is set, or if some perturbed systems were singular and had to be dropped.
+    """
+    quantity: str
+    deterministic: float
+    samples: int
+    truncated: bool = False
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    percentiles: List[float]
+    values: List[float] = []
+
+
+class ScenarioOverride(BaseModel):
+    """
+    Replace the value of the node's direct exchanges of a flow-- narrowed by direction and termination (a process
+    external_ref, or a context name) if given
+    """
+    flow: str
+    direction: Optional[str] = None
+    termination: Optional[str] = None
+    value: float
+
+
+class Scenario(BaseModel):
+    name: Optional[str] = None
+    overrides: List[ScenarioOverride] = []
+
+
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario]
+    detailed: bool = False
+
+
+class ScenarioExchangeScore(BaseModel):
+    flow: str
+    direction: str
+    termination: Optional[str]
+    value: float
+    results: List[float]
+
+
+class ScenarioResult(BaseModel):
+    """
+    A scenario's scores, one per category.  details (per-exchange contributions) only if requested.
+    """
+    name: Optional[str] = None
+    results: List[float] = []
+    error: Optional[str] = None
+    details: Optional[List[ScenarioExchangeScore]] = None
+
+
+class ScenarioBatchResult(BaseModel):
+    origin: str
+    process: str
+    ref_flow: str
+    quantities: List[str]
+    base: List[float]
+    scenarios: List[ScenarioResult]
+
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    submitted: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_job(cls, job):
+        return cls(id=job.id, kind=job.kind, status=job.status, submitted=job.submitted, started=job.started,
+                   finished=job.finished, error=job.error)
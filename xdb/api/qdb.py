@@ -36,19 +36,20 @@ exchanges.  The locale of the conversion is reported in the QRResult.
 """
 
 from api.models.response import QdbMeta, PostFactors
-from .runtime import cat, search_entities, do_lcia
+from .runtime import cat, search_entities, do_lcia, category_executor
+from .libs.timing import TimedRoute, timed
 from fastapi import APIRouter, HTTPException
 from typing import List, Optional
 
 import re
 
-from antelope import EntityNotFound, UnknownOrigin, CatalogRef, ExchangeRef, ConversionReferenceMismatch, NoFactorsFound
+from antelope import EntityNotFound, UnknownOrigin, CatalogRef, ExchangeRef
 from antelope.models import Entity, Context, Characterization, DetailedLciaResult, UnallocatedExchange, FlowSpec
 from antelope_core.entities import MetaQuantityUnit, LcFlow, LcProcess
 
 lcia = cat.lcia_engine
 
-qdb_router = APIRouter(prefix="/qdb")
+qdb_router = APIRouter(prefix="/qdb", route_class=TimedRoute)
 
 
 @qdb_router.get("/", response_model=QdbMeta)
@@ -139,15 +140,12 @@ def get_contexts(context: str):
 
 def _get_canonical(origin, quantity):
     try:
-        if origin is None:
-            q = lcia.get_canonical(quantity)
-        else:
-            cat.query(origin).get(quantity)  # registers it with qdb
-            q = lcia.get_canonical(quantity)
+        q, _ = cat.canonical_quantity(origin, quantity)  # registers it with qdb the first time
     except EntityNotFound:
         raise HTTPException(404, f"quantity {quantity} not found")
     except UnknownOrigin:
         raise HTTPException(404, f"Unknown origin {origin}")
+    cat.cf_index(q)  # built once, for bulk factor lookups
     return q
 
 
@@ -173,39 +171,68 @@ def load_quantity(quantity: str, origin: str = None):
     return ent
 
 
-def _lcia_exch_ref(p, x):
+def _flow_spec_key(x):
+    fs = x.flow
+    return x.origin, fs.external_ref, fs.flowable, fs.quantity_ref, tuple(fs.context), fs.locale
+
+
+def _resolve_flow(x):
     """
-    This turns a provided inventory exchange into an input argument for LCIA
-    at the other end, the
-    :param p:
-    :param x:
+    This turns a posted flow spec into a flow to characterize: the qdb's own entity if it knows the external ref,
+    otherwise a transient flow made from the spec.  Transient flows are NOT registered with the catalog.
+    :param x: UnallocatedExchange
     :return:
     """
-    if p.origin is None:
-        p.origin = x.origin
     if x.flow.external_ref is not None:  # FlowSpec.external_ref is OPTIONAL
         try:
-            flow = cat.get_qdb_entity(x.origin, x.flow.external_ref)
+            return cat.get_qdb_entity(x.origin, x.flow.external_ref)
         except KeyError:
             """
             Need to use: external_ref, quantity_ref, flowable, context, locale.
             Need to think about including CAS number (or synonyms) in FlowSpec as optional params
             """
             ref_q = _get_canonical(x.origin, x.flow.quantity_ref)
-            flow = CatalogRef.from_query(x.flow.external_ref, cat._qdb.query, 'flow', masquerade=x.origin,
+            return CatalogRef.from_query(x.flow.external_ref, cat._qdb.query, 'flow', masquerade=x.origin,
                                          name=x.flow.flowable, reference_entity=ref_q,
                                          context=tuple(x.flow.context), locale=x.flow.locale)
-            cat.register_entity_ref(flow)
-    else:
-        # no ref, so nothing to anchor the flow to- we use it just for the lookup
-        ref_q = _get_canonical(x.origin, x.flow.quantity_ref)
-        flow = LcFlow.new(x.flow.flowable, ref_q,
-                          context=tuple(x.flow.context), locale=x.flow.locale)
-    if x.type == 'context':
-        term = tuple(x.context)
-    else:
-        term = x.termination
-    return ExchangeRef(p, flow, x.direction, value=x.value, termination=term)
+    # no ref, so nothing to anchor the flow to- we use it just for the lookup
+    ref_q = _get_canonical(x.origin, x.flow.quantity_ref)
+    return LcFlow.new(x.flow.flowable, ref_q, context=tuple(x.flow.context), locale=x.flow.locale)
+
+
+def _lcia_inventory(p, exchanges):
+    """
+    This turns provided inventory exchanges into an input argument for LCIA.  Each distinct flow spec is resolved once,
+    through the catalog's bounded cache of transient flows (which also keeps the flows' looked-up factors), and
+    exchanges with the same flow spec, direction and termination are combined into one.
+    :param p: the process to hang the exchanges on
+    :param exchanges: list of UnallocatedExchange
+    :return: list of ExchangeRefs
+    """
+    flows = dict()
+    combined = dict()  # key -> [flow, direction, value, termination], in order of first appearance
+    for i, x in enumerate(exchanges):
+        if p.origin is None:
+            p.origin = x.origin
+        fk = _flow_spec_key(x)
+        flow = flows.get(fk)
+        if flow is None:
+            flow = cat.transient_flows.get(fk)
+            if flow is None:
+                flow = _resolve_flow(x)
+                cat.transient_flows.put(fk, flow)
+            flows[fk] = flow
+        if x.type == 'context':
+            term = tuple(x.context)
+        else:
+            term = x.termination
+        key = (fk, x.direction, term) if x.value is not None else i  # no value, nothing to add up
+        if key in combined:
+            combined[key][2] += x.value
+        else:
+            combined[key] = [flow, x.direction, x.value, term]
+    return [ExchangeRef(p, flow, dirn, value=value, termination=term)
+            for flow, dirn, value, term in combined.values()]
 
 
 @qdb_router.post('/{quantity_id}/do_lcia', response_model=List[DetailedLciaResult])
@@ -222,9 +249,12 @@ def post_lcia_exchanges(quantity_id: str, exchanges: List[UnallocatedExchange],
     """
     q = _get_canonical(None, quantity_id)
     p = LcProcess.new('LCIA POST')
-    inv = [_lcia_exch_ref(p, x) for x in exchanges]
-    ress = do_lcia(lcia, q, inv, locale=locale, quell_biogenic_co2=quell_biogenic_co2)
-    return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
+    inv = _lcia_inventory(p, exchanges)
+    qs = list(cat.quantity_categories(q))
+    with timed('compute'):
+        ress = do_lcia(lcia, q, inv, categories=qs, locale=locale, quell_biogenic_co2=quell_biogenic_co2)
+    with timed('serialize'):
+        return [DetailedLciaResult.from_lcia_result(p, res) for res in ress]
 
 
 @qdb_router.post('/{quantity_id}/factors', response_model=List[PostFactors])
@@ -237,24 +267,20 @@ def post_flow_specs(quantity_id: str, flow_specs: List[FlowSpec]):
     """
     qq = _get_canonical(None, quantity_id)
     lookup_results = []
-    if qq.unit == MetaQuantityUnit.unitstring and qq.has_property('impactCategories'):
+    qs = cat.quantity_categories(qq)  # if qq is an LCIA method, we want to give back ALL the factors
+
+    def _lookup(q):
         """
-        q is actually an LCIA method- we want to give back ALL the factors
-        This needs DRY (in runtime.py)
+        This smacks of DRY too
         """
-        qs = [_get_canonical(qq.origin, k) for k in qq['impactCategories']]
-    else:
-        qs = [qq]
-    for fs in flow_specs:
+        return [cat.quantity_relation(q, fs.flowable, fs.quantity_ref, tuple(fs.context), fs.locale)
+                for fs in flow_specs]
+
+    by_category = category_executor.map(_lookup, qs)  # one column per category, in category order
+    for i, fs in enumerate(flow_specs):
         res = PostFactors(flow_id=fs.external_ref, context=fs.context, factors=[])
-        for q in qs:
-            """
-            This smacks of DRY too
-            """
-            try:
-                qr = q.quantity_relation(fs.flowable, fs.quantity_ref, tuple(fs.context), fs.locale)
-            except (ConversionReferenceMismatch, NoFactorsFound):
-                continue
-            res.add_qr_result(qr)
+        for qrs in by_category:
+            if qrs[i] is not None:
+                res.add_qr_result(qrs[i])
         lookup_results.append(res)
     return lookup_results
@@ -4,11 +4,13 @@ import tempfile
 from fastapi import HTTPException
 from antelope.models import Entity, FlowEntity
 # from antelope_core.auth import AuthorizationGrant
-from antelope_core.entities import MetaQuantityUnit
 # from antelope_core.catalog import LcCatalog
 from antelope_core.file_accessor import ResourceLoader
+from antelope_core.lcia_results import LciaResult
 
 from .libs.xdb_catalog import XdbCatalog
+from .libs.executor import CategoryExecutor
+from .libs.search_index import SEARCH_FIELDS
 
 # from antelope_manager.authorization import MASTER_ISSUER, open_public_key
 import os
@@ -45,6 +47,10 @@ if CAT_ROOT is None:
 DATA_ROOT = os.getenv('XDB_DATA_ROOT')
 DATA_AWS_BUCKET = 'antelope-data'
 
+# impact categories are evaluated concurrently on a shared pool; each request gets at most LCIA_PARALLELISM workers
+LCIA_WORKERS = int(os.getenv('XDB_LCIA_WORKERS', 8))
+LCIA_PARALLELISM = int(os.getenv('XDB_LCIA_PARALLELISM', 4))
+
 
 def lca_init():
     _cat = XdbCatalog(CAT_ROOT, strict_clookup=False, quell_biogenic_co2=True)
@@ -54,6 +60,7 @@ def lca_init():
 
 
 cat = lca_init()
+category_executor = CategoryExecutor(LCIA_WORKERS, per_request=LCIA_PARALLELISM)
 
 
 def _aws_sync_origin(origin):
@@ -82,20 +89,62 @@ def init_origin(origin, reset=False):
     elif not os.path.exists(os.path.join(DATA_ROOT, origin)):
         _aws_sync_origin(origin)
     rl = ResourceLoader(DATA_ROOT)
-    return rl.load_resources(cat, origin, check=True)
+    result = rl.load_resources(cat, origin, check=True)
+    cat.invalidate_origin(origin)
+    cat.search_index(origin)  # index entities for search now, rather than on the first search
+    return result
 
 
-def search_entities(query, etype, count=50, **kwargs):
+def _indexed_search(query, etype, sargs):
+    """
+    Answer a token search from the origin's token index, if it can be
+    :param query: authorized query
+    :param etype:
+    :param sargs: non-None search keywords (including quantities' 'unit')
+    :return: generator of entities, or None if the search has to scan
+    """
+    itype = 'quantities' if etype == 'lcia_methods' else etype
+    if itype not in SEARCH_FIELDS:
+        return None
+    if query.origin == cat._qdb.ref:  # grows as quantities are registered; an index would go stale
+        return None
+    index = cat.search_index(query.origin)
+    if not index.indexed(itype):
+        return None
+    unit = sargs.get('unit')
+    it = index.search(itype, **{k: v for k, v in sargs.items() if k != 'unit'})
+    if it is None:
+        return None
+    query.authorize('index', etype)  # as the index interface would have
+    if etype == 'lcia_methods':
+        it = filter(lambda x: x.has_property('Indicator'), it)
+    if unit is not None:
+        it = filter(lambda x: x.unit == unit, it)
+    return it
+
+
+def search_entities(query, etype, count=50, tokens=False, **kwargs):
+    """
+    :param query: authorized query
+    :param etype:
+    :param count: [50] most entities to return
+    :param tokens: [False] match plain words against the starts of words, from the origin's token index (see
+     search_index.py).  Otherwise every keyword is a regex, matched anywhere in the property.
+    :param kwargs: search keywords
+    :return: generator of Entity models
+    """
     sargs = {k: v for k, v in filter(lambda x: x[1] is not None, kwargs.items())}
     if etype not in _ETYPES:
         raise HTTPException(404, "Invalid entity type %s" % etype)
     logging.info('search origin %s/%s ' % (query.origin, etype))
     for k, v in sargs.items():
         logging.info('search item |%s|%s|' % (k, v))
-    try:
-        it = getattr(query, etype)(**sargs)
-    except AttributeError:
-        raise HTTPException(404, "Unknown entity type %s" % etype)
+    it = _indexed_search(query, etype, sargs) if tokens else None
+    if it is None:  # regex scan
+        try:
+            it = getattr(query, etype)(**sargs)
+        except AttributeError:
+            raise HTTPException(404, "Unknown entity type %s" % etype)
     sargs.pop('unit', None)  # special arg that gets passed to quantity method but does not work as a property
     for e in it:
         if not e.origin.startswith(query.origin):  # return more-specific
@@ -109,11 +158,82 @@ def search_entities(query, etype, count=50, **kwargs):
             break
 
 
-def do_lcia(query, qq, lci, **kwargs):
-    if qq.unit == MetaQuantityUnit.unitstring and qq.has_property('impactCategories'):
-        qs = [query.get_canonical(k) for k in qq['impactCategories']]
+def lcia_categories(query, qq):
+    """
+    The quantities to compute for qq: an LCIA method's impactCategories, else qq itself.  Resolved once per quantity
+    in the catalog (the query's canonical quantities are the catalog's), but each category is still authorized and
+    metered on the query as the get_canonical it stands in for.
+    :param query: authorized query for the quantity's origin
+    :param qq: canonical quantity
+    :return: list of canonical quantities
+    """
+    qs = list(cat.quantity_categories(qq))
+    if qs != [qq]:
+        for _ in qs:
+            query.authorize('quantity', 'get_canonical')
+    return qs
+
+
+def do_lcia(query, qq, lci, key=None, categories=None, **kwargs):
+    """
+    :param query: authorized query for the quantity's origin
+    :param qq: a canonical quantity, or an LCIA method whose impactCategories are to be computed
+    :param lci: inventory
+    :param key: [None] identity of the inventory, e.g. (origin, process, ref_flow). If given, the inventory is taken
+     to be a background LCI: identical concurrent computations are coalesced (category resolution still happens per
+     request), and LCIA uses the catalog's memoized characterization vectors
+    :param categories: [None] result of lcia_categories(query, qq), if the caller already has it
+    :param kwargs:
+    :return: list of LciaResults
+    """
+    if categories is None:
+        qs = lcia_categories(query, qq)
     else:
-        qs = [qq]
+        qs = categories
+
+    if key is None:
+        return category_executor.map(lambda q: q.do_lcia(lci, **kwargs), qs)
+
+    locale = kwargs.pop('locale', None) or 'GLO'
+    dist = kwargs.pop('dist', 2)
+
+    def _lcia(q):
+        qkey = key + ('do_lcia', q.origin, q.external_ref, locale, dist, tuple(sorted(kwargs.items())))
+        if kwargs:  # options the memo doesn't know about
+            res, _ = cat.inflight.do(qkey, q.do_lcia, lci, locale=locale, dist=dist, **kwargs)
+        else:
+            vec = cat.characterization_vector(q, locale=locale, dist=dist)
+            res, _ = cat.inflight.do(qkey, vec.lcia, lci)
+        return res
 
     # check authorization for detailed Lcia
-    return [q.do_lcia(lci, **kwargs) for q in qs]
+    return category_executor.map(_lcia, qs)
+
+
+def table_lcia(pq, process, ref_flow, qs):
+    """
+    Summary LCIA results from the materialized LCIA tables, if every category has a table covering the node.
+    Authorization and metering are the same as for the live computation: the process's background lci.
+    :param pq: authorized query for the process's origin
+    :param process: ProcessRef
+    :param ref_flow: external ref of the reference flow
+    :param qs: categories, as from lcia_categories()
+    :return: list of LciaResults, or None to compute live
+    """
+    scores = []
+    for q in qs:
+        table = cat.lcia_table(pq.origin, q)
+        if table is None:
+            return None
+        score = table.score(process.external_ref, ref_flow)
+        if score is None:
+            return None
+        scores.append((table.quantity, score))
+
+    pq.authorize('background', 'lci')
+    ress = []
+    for q, score in scores:
+        res = LciaResult(q)
+        res.add_summary((process.external_ref, ref_flow), process, 1.0, score)
+        ress.append(res)
+    return ress
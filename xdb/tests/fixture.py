@@ -0,0 +1,90 @@
+"""
+A tiny background database for checking the server's shortcuts against the core computations they stand in for.
+
+Coal mining and the power plant supply each other, so they form the background (one strongly connected component); the
+steel mill and the car factory sit on top of it in the foreground.  Two LCIA quantities characterize the emissions:
+GWP has a factor at exactly each emission's context (plus a zero factor), and Acidification has one factor filed at a
+parent context, which only the engine's context matching can find.
+"""
+
+from antelope.models.auth import AuthorizationGrant
+from antelope_core.archives import LcArchive
+from antelope_core.entities import LcQuantity, LcFlow, LcProcess
+
+from api.libs.xdb_catalog import XdbCatalog
+
+import os
+
+
+ORIGIN = 'test.xdb'
+AIR = ('emissions', 'to air')
+
+
+class BackgroundFixture(object):
+    def __init__(self, rootdir):
+        """
+
+        :param rootdir: a scratch directory for the catalog
+        """
+        self.catalog = XdbCatalog(rootdir, strict_clookup=False)
+        ar = LcArchive(os.path.join(rootdir, 'fixture.json'), ref=ORIGIN)
+
+        mass = LcQuantity.new('mass', 'kg', origin=ORIGIN)
+        gwp = LcQuantity.new('Global warming', 'kg CO2 eq', origin=ORIGIN, Indicator='GWP 100', Method='Fixture')
+        acid = LcQuantity.new('Acidification', 'kg SO2 eq', origin=ORIGIN, Indicator='AP', Method='Fixture')
+        for q in (mass, gwp, acid):
+            ar.add(q)
+
+        def _flow(name, context=None):
+            f = LcFlow.new(name, ref_qty=mass, context=context, origin=ORIGIN)
+            ar.add(f)
+            return f
+
+        self.co2 = _flow('carbon dioxide', AIR)
+        self.ch4 = _flow('methane', AIR)
+        self.n2 = _flow('nitrogen', AIR)
+        self.so2 = _flow('sulfur dioxide', AIR)
+        coal = _flow('hard coal')
+        elec = _flow('electricity')
+        steel = _flow('steel')
+        car = _flow('car')
+        water = _flow('process water')  # not supplied by anything: a cutoff
+        self.exterior = [self.co2, self.ch4, self.n2, self.so2]
+
+        ar.tm.add_characterization('carbon dioxide', mass, gwp, 1.0, context=AIR)
+        ar.tm.add_characterization('methane', mass, gwp, 28.0, context=AIR)
+        ar.tm.add_characterization('nitrogen', mass, gwp, 0.0, context=AIR)
+        ar.tm.add_characterization('sulfur dioxide', mass, acid, 1.0, context=AIR[:1])
+        air = ar.tm[AIR]
+
+        def _process(name, ref, inputs, emissions):
+            p = LcProcess.new(name, origin=ORIGIN)
+            ar.add(p)
+            p.add_exchange(ref, 'Output', value=1.0)
+            p.set_reference(ref, 'Output')
+            for f, v, t in inputs:
+                p.add_exchange(f, 'Input', value=v, termination=t)
+            for f, v in emissions:
+                p.add_exchange(f, 'Output', value=v, termination=air)
+            return p
+
+        mine = _process('coal mining', coal, [], [(self.ch4, 0.01)])
+        plant = _process('power plant', elec, [(coal, 0.4, mine.external_ref)],
+                         [(self.co2, 0.9), (self.so2, 0.003), (self.n2, 0.5)])
+        mine.add_exchange(elec, 'Input', value=0.05, termination=plant.external_ref)
+        mill = _process('steel mill', steel, [(elec, 0.6, plant.external_ref), (coal, 0.7, mine.external_ref),
+                                              (water, 3.0, None)],
+                        [(self.co2, 1.8)])
+        factory = _process('car factory', car, [(steel, 900.0, mill.external_ref),
+                                                (elec, 2500.0, plant.external_ref)],
+                           [(self.ch4, 0.2)])
+        self.process_refs = [p.external_ref for p in (mine, plant, mill, factory)]
+
+        self.catalog.add_existing_archive(ar, interfaces=('basic', 'index', 'exchange', 'quantity'), store=False)
+        grants = [AuthorizationGrant(user='tester', origin=ORIGIN, access=a, values=True)
+                  for a in ('index', 'exchange', 'background', 'quantity')]
+        self.query = self.catalog.authorized_query(ORIGIN, grants)
+        self.quantities = [self.query.get_canonical(self.query.get(q.external_ref)) for q in (gwp, acid)]
+
+    def processes(self):
+        return [self.query.get(k) for k in self.process_refs]
@@ -0,0 +1,76 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+from antelope import ConversionReferenceMismatch, NoFactorsFound
+
+from .fixture import BackgroundFixture, AIR
+
+
+CONTEXTS = (AIR, AIR[:1], ('emissions', 'to water'))
+LOCALES = ('GLO', 'US')
+
+
+def _engine(q, flow, cx, loc):
+    try:
+        return q.quantity_relation(flow.name, flow.reference_entity, cx, locale=loc)
+    except (ConversionReferenceMismatch, NoFactorsFound):
+        return None
+
+
+class CfIndexTest(unittest.TestCase):
+    """
+    Wherever CfIndex.lookup answers, it must give what the engine's quantity_relation gives; and the catalog's
+    memoized quantity_relation must agree with the engine everywhere
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = TemporaryDirectory()
+        cls.fx = BackgroundFixture(cls._tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def _cases(self):
+        for q in self.fx.quantities:
+            for f in self.fx.exterior:
+                for cx in CONTEXTS:
+                    for loc in LOCALES:
+                        yield q, f, cx, loc
+
+    def test_lookup_matches_engine(self):
+        answered = set()
+        for q, f, cx, loc in self._cases():
+            index = self.fx.catalog.cf_index(q)
+            with self.subTest(quantity=q.external_ref, flowable=f.name, context=cx, locale=loc):
+                qr = index.lookup(f.name, f.reference_entity, cx, loc)
+                if qr is None:
+                    continue
+                answered.add((q.external_ref, f.name, cx))
+                ref = _engine(q, f, cx, loc)
+                self.assertIsNotNone(ref)
+                self.assertEqual(ref.value, qr.value)
+                self.assertEqual(ref.locale, qr.locale)
+        gwp, acid = (q.external_ref for q in self.fx.quantities)
+        self.assertSetEqual(answered, {(gwp, 'carbon dioxide', AIR), (gwp, 'methane', AIR), (gwp, 'nitrogen', AIR),
+                                       (acid, 'sulfur dioxide', AIR[:1])})
+
+    def test_catalog_relation_matches_engine(self):
+        for _ in range(2):  # the second pass is answered from the index and the memo
+            for q, f, cx, loc in self._cases():
+                with self.subTest(quantity=q.external_ref, flowable=f.name, context=cx, locale=loc):
+                    ref = _engine(q, f, cx, loc)
+                    qr = self.fx.catalog.quantity_relation(q, f.name, f.reference_entity, cx, loc)
+                    if ref is None:
+                        self.assertIsNone(qr)
+                    else:
+                        self.assertIsNotNone(qr)
+                        self.assertEqual(ref.value, qr.value)
+
+    def test_non_lcia(self):
+        mass = self.fx.exterior[0].reference_entity
+        self.assertIsNone(self.fx.catalog.cf_index(self.fx.catalog.lcia_engine.get_canonical(mass)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+from api.libs.incremental import incremental_unobserved_lci
+
+from .fixture import BackgroundFixture
+
+
+def _totals(lci):
+    t = dict()
+    for x in lci:
+        k = (x.flow.external_ref, x.direction, str(x.termination))
+        t[k] = t.get(k, 0.0) + x.value
+    return t
+
+
+TOL = 1e-6  # relative to the node's own LCI: the background solves are iterative, converged to about 1e-8
+
+
+class IncrementalUnobservedLciTest(unittest.TestCase):
+    """
+    incremental_unobserved_lci must give the same numbers as ProcessRef.unobserved_lci, for any observed set
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = TemporaryDirectory()
+        cls.fx = BackgroundFixture(cls._tmp.name)
+        cls.flat = cls.fx.catalog.background_solver(cls.fx.query.origin).flat
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def _observed_sets(self, p, rx):
+        deps = list(p.dependencies(ref_flow=rx))
+        for x in deps:
+            yield [x]
+        yield deps
+        ems = list(p.emissions(ref_flow=rx))
+        if ems:
+            yield ems[:1]
+            yield deps + ems[:1]
+
+    def assertSameLci(self, expected, actual, scale):
+        """
+        :param scale: the node's full LCI, which bounds the magnitude of anything the incremental route subtracts
+        """
+        e, a, s = _totals(expected), _totals(actual), _totals(scale)
+        self.assertSetEqual(set(e), set(a))
+        for k in e:
+            self.assertAlmostEqual(e[k], a[k], delta=TOL * max(abs(s.get(k, 0.0)), abs(e[k])), msg=str(k))
+
+    def test_matches_unobserved_lci(self):
+        n = 0
+        for p in self.fx.processes():
+            rx = p.reference()
+            scale = list(p.lci(rx))
+            for observed in self._observed_sets(p, rx):
+                with self.subTest(process=p.external_ref, observed=len(observed)):
+                    obs = set((x.flow.external_ref, x.direction) for x in observed)
+                    lci = incremental_unobserved_lci(self.fx.query, self.flat, p, obs, rx)
+                    self.assertIsNotNone(lci)  # every dependency in the fixture is a background node
+                    self.assertSameLci(list(p.unobserved_lci(observed, ref_flow=rx)), lci, scale)
+                    n += 1
+        self.assertGreater(n, 0)
+
+    def test_query_incremental_matches(self):
+        for p in self.fx.processes():
+            rx = p.reference()
+            scale = list(p.lci(rx))
+            for observed in self._observed_sets(p, rx):
+                with self.subTest(process=p.external_ref, observed=len(observed)):
+                    full = self.fx.query.unobserved_lci(p, observed, ref_flow=rx)
+                    incr = self.fx.query.unobserved_lci(p, observed, ref_flow=rx, incremental=True)
+                    self.assertSameLci(full, incr, scale)
+                    self.assertSameLci(list(p.unobserved_lci(observed, ref_flow=rx)), incr, scale)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+from .fixture import BackgroundFixture, ORIGIN
+
+
+TOL = 1e-7  # the live LCIs come from the flat background's iterative solve, converged to about 1e-8
+
+
+class LciaTableTest(unittest.TestCase):
+    """
+    A materialized LCIA table's unit score must match live LCIA of the node's LCI, for foreground and background nodes
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = TemporaryDirectory()
+        cls.fx = BackgroundFixture(cls._tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def _check_tables(self):
+        cat = self.fx.catalog
+        for q in self.fx.quantities:
+            table = cat.lcia_table(ORIGIN, q)
+            self.assertIsNotNone(table)
+            vec = cat.characterization_vector(q)
+            for p in self.fx.processes():
+                rx = p.reference()
+                with self.subTest(quantity=q.external_ref, process=p.external_ref):
+                    lci = list(p.lci(rx))
+                    live = q.do_lcia(lci).total()
+                    score = table.score(p.external_ref, rx.flow.external_ref)
+                    self.assertIsNotNone(score)
+                    self.assertAlmostEqual(live, score, delta=TOL * max(abs(live), 1.0))
+                    self.assertAlmostEqual(vec.lcia(lci).total(), score, delta=TOL * max(abs(live), 1.0))
+
+    def test_built_tables_match_live(self):
+        n = self.fx.catalog.build_lcia_tables(ORIGIN, self.fx.quantities, save=False)
+        self.assertEqual(n, len(self.fx.process_refs))
+        self._check_tables()
+
+    def test_saved_tables_match_live(self):
+        cat = self.fx.catalog
+        cat.build_lcia_tables(ORIGIN, self.fx.quantities, save=True)
+        cat.lcia_tables.discard_if(lambda k, v: k[0] == ORIGIN)  # force a reload from disk
+        self._check_tables()
+
+    def test_unknown_node(self):
+        cat = self.fx.catalog
+        cat.build_lcia_tables(ORIGIN, self.fx.quantities, save=False)
+        self.assertIsNone(cat.lcia_table(ORIGIN, self.fx.quantities[0]).score('no such process', 'car'))
+
+
+if __name__ == '__main__':
+    unittest.main()
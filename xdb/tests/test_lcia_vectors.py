@@ -0,0 +1,72 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+from api.libs.lcia_vectors import CharacterizationVector
+
+from .fixture import BackgroundFixture
+
+
+def _details(res, key):
+    return sorted((d.flow.external_ref, d.direction, str(d.context), d.value, d.factor, d.result)
+                  for d in res[key].details())
+
+
+class CharacterizationVectorTest(unittest.TestCase):
+    """
+    CharacterizationVector.lcia() must give the same LciaResult as core do_lcia: same components, same details, same
+    cutoffs, zeros and errors, same total-- on first use and again from the memo
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = TemporaryDirectory()
+        cls.fx = BackgroundFixture(cls._tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def _inventories(self):
+        for p in self.fx.processes():
+            rx = p.reference()
+            yield p, list(p.lci(rx))
+            yield p, list(p.inventory(rx))  # includes the reference and a cutoff
+
+    def _assert_same(self, core, vec):
+        self.assertAlmostEqual(core.total(), vec.total(), places=12)
+        self.assertSetEqual(set(core.keys()), set(vec.keys()))
+        for k in core.keys():
+            self.assertAlmostEqual(core[k].cumulative_result, vec[k].cumulative_result, places=12)
+            self.assertListEqual(_details(core, k), _details(vec, k))
+        for part in ('cutoffs', 'zeros', 'errors'):
+            self.assertListEqual(sorted(str(x) for x in getattr(core, part)()),
+                                 sorted(str(x) for x in getattr(vec, part)()))
+
+    def test_lcia_matches_core(self):
+        for q in self.fx.quantities:
+            vec = CharacterizationVector(q)
+            for _ in range(2):  # the second pass is answered entirely from the memo
+                for p, inv in self._inventories():
+                    with self.subTest(quantity=q.external_ref, process=p.external_ref, n=len(inv)):
+                        self._assert_same(q.do_lcia(inv), vec.lcia(inv))
+
+    def test_catalog_vector_matches_core(self):
+        for q in self.fx.quantities:
+            vec = self.fx.catalog.characterization_vector(q)
+            self.assertIs(vec, self.fx.catalog.characterization_vector(q))
+            for p, inv in self._inventories():
+                with self.subTest(quantity=q.external_ref, process=p.external_ref, n=len(inv)):
+                    self._assert_same(q.do_lcia(inv), vec.lcia(inv))
+
+    def test_factors(self):
+        q = self.fx.quantities[0]
+        vec = CharacterizationVector(q)
+        p = self.fx.processes()[-1]
+        inv = list(p.lci(p.reference()))
+        cols = vec.columns(inv)
+        f = vec.factors()
+        self.assertAlmostEqual(sum(f[c] * x.value for c, x in zip(cols, inv) if c is not None),
+                               q.do_lcia(inv).total(), places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()